@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+# Global fit of one doublet in N spectra: variable projection (only the shared
+# centroids and widths are iterated) vs. one dense fit of all the parameters.
+#
+# usage: python3 benchmarks/bench_global_fit.py
+import os
+import sys
+import time
+
+import numpy as np
+from scipy.optimize import leastsq
+from lmfit.lineshapes import gaussian
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from spectview.global_fitter import GlobalPeakFitter
+from spectview.datatypes import Peak
+
+CENTROIDS = (100.0, 108.0)
+WIDTH = 3.0
+
+
+def synthetic_spectra(n_spectra, seed=0):
+    random_state = np.random.RandomState(seed)
+    data_x = np.arange(0.0, 200.0)
+    spectra = []
+    for _ in range(n_spectra):
+        expected = random_state.uniform(1, 10) + sum(
+            gaussian(data_x, random_state.uniform(200, 800), centroid, WIDTH) for centroid in CENTROIDS
+        )
+        spectra.append((data_x, random_state.poisson(expected).astype(float)))
+    peaks = [Peak(centroid + 0.5, 50) for centroid in CENTROIDS]
+    return spectra, peaks
+
+
+def dense_fit(spectra, peaks):
+    # all the parameters (shared and of every spectrum) in one leastsq fit
+    n_peaks = len(peaks)
+
+    def residual(values):
+        cen, wid = values[:n_peaks], values[n_peaks:2 * n_peaks]
+        output = []
+        for j, (data_x, data_y) in enumerate(spectra):
+            local = values[2 * n_peaks + j * (n_peaks + 2):2 * n_peaks + (j + 1) * (n_peaks + 2)]
+            model = local[-2] * data_x + local[-1] + sum(
+                gaussian(data_x, local[i], cen[i], wid[i]) for i in range(n_peaks)
+            )
+            output.append(model - data_y)
+        return np.concatenate(output)
+
+    start = [peak.centroid for peak in peaks] + [1.0] * n_peaks
+    for _ in spectra:
+        start += [peak.amp for peak in peaks] + [0.0, 0.0]
+    values, _, info, _, _ = leastsq(residual, start, full_output=True)
+    return values, info['nfev']
+
+
+def main():
+    print(f'{"spectra":>8} {"dense [ms]":>11} {"nfev":>6} {"global [ms]":>12} {"nfev":>6} {"speedup":>8}')
+    for n_spectra in (1, 4, 16, 64):
+        spectra, peaks = synthetic_spectra(n_spectra)
+
+        start = time.perf_counter()
+        _, dense_nfev = dense_fit(spectra, peaks)
+        dense_time = time.perf_counter() - start
+
+        global_fit = GlobalPeakFitter(spectra, peaks)
+        start = time.perf_counter()
+        global_fit.do_fit()
+        global_time = time.perf_counter() - start
+
+        print(
+            f'{n_spectra:>8} {1e3 * dense_time:>11.1f} {dense_nfev:>6} {1e3 * global_time:>12.1f}'
+            f' {global_fit.result.nfev:>6} {dense_time / global_time:>7.1f}x'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+# Multiplet fit: vectorized model with the analytic jacobian vs. the previous
+# per-peak lmfit gaussian model with finite difference derivatives.
+#
+# usage: python3 benchmarks/bench_peak_fitter.py
+import os
+import sys
+import time
+from functools import partial
+
+import numpy as np
+from lmfit import Minimizer
+from lmfit.lineshapes import gaussian
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from spectview.datatypes import Peak
+from spectview.peak_fitter import FWHM_TO_SIGMA, PeakFitter
+
+
+class LegacyPeakFitter(PeakFitter):
+
+    def _gaussian_peaks(self, params, data_x):
+        return sum(
+            gaussian(data_x, params[f'amp_{i}'], params[f'cen_{i}'], params[f'wid_{i}'])
+            for i, peak in enumerate(self.peaks)
+        )
+
+    def do_fit(self, verbosity=False, analytic_jacobian=False):
+        myfit = Minimizer(self.residual, self.params,
+                          fcn_args=(self.data_x,), fcn_kws={'data_y': self.data_y},
+                          scale_covar=True)
+        self.result = myfit.leastsq()
+
+
+def synthetic_multiplet(n_peaks, spacing=6.0, width=1.5, seed=0):
+    random_state = np.random.RandomState(seed)
+    data_x = np.arange(0, spacing * (n_peaks + 3))
+    centroids = spacing * (np.arange(n_peaks) + 2) + random_state.uniform(-1, 1, n_peaks)
+    areas = random_state.uniform(200, 2000, n_peaks)
+
+    expected = 5.0 + 0.02 * data_x
+    for centroid, area in zip(centroids, areas):
+        expected = expected + gaussian(data_x, area, centroid, width)
+    data_y = random_state.poisson(expected)
+
+    # initial guesses as clicked by hand: close to the peaks, at the top of them
+    peaks = [
+        Peak(centroid + random_state.uniform(-0.5, 0.5), data_y[int(round(centroid))])
+        for centroid in centroids
+    ]
+    return data_x, data_y, peaks
+
+
+def time_fit(fitter_class, data_x, data_y, peaks, repeat):
+    timings = []
+    for _ in range(repeat):
+        peak_fit = fitter_class(data_x=data_x, data_y=data_y, peaks=peaks)
+        start = time.perf_counter()
+        peak_fit.do_fit()
+        timings.append(time.perf_counter() - start)
+    return min(timings), peak_fit.result
+
+
+def main(repeat=3):
+    # constrained: the widths follow a constant FWHM calibration times a free scale
+    constrained_fitter = partial(PeakFitter, fwhm_calibration=((1.5 / FWHM_TO_SIGMA)**2, 0.0, 0.0))
+    print(
+        f'{"peaks":>6} {"legacy [ms]":>12} {"nfev":>6} {"vectorized [ms]":>16} {"nfev":>6} {"speedup":>8}'
+        f' {"constrained [ms]":>17} {"nfev":>6} {"params":>7}'
+    )
+    for n_peaks in (1, 4, 8, 12, 15):
+        data = synthetic_multiplet(n_peaks)
+        legacy_time, legacy_result = time_fit(LegacyPeakFitter, *data, repeat=repeat)
+        new_time, new_result = time_fit(PeakFitter, *data, repeat=repeat)
+        constrained_time, constrained_result = time_fit(constrained_fitter, *data, repeat=repeat)
+        print(
+            f'{n_peaks:>6} {1e3 * legacy_time:>12.1f} {legacy_result.nfev:>6} '
+            f'{1e3 * new_time:>16.1f} {new_result.nfev:>6} {legacy_time / new_time:>7.1f}x'
+            f' {1e3 * constrained_time:>17.1f} {constrained_result.nfev:>6} {constrained_result.nvarys:>7}'
+        )
+
+
+if __name__ == '__main__':
+    main()
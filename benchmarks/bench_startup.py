@@ -0,0 +1,131 @@
+#!/usr/bin/python3
+# Start up time of the spectview: imports of the GUI and of the headless modules
+# and the time to the first drawn frame, every case in a fresh interpreter.
+#
+# usage: python3 benchmarks/bench_startup.py --save startup_baseline.json
+#        python3 benchmarks/bench_startup.py --compare startup_baseline.json [--tolerance 0.25]
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+
+from run_benchmarks import compare
+
+REPO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# modules which should be loaded only when they are needed
+LAZY_MODULES = ['tkinter', 'lmfit', 'scipy', 'h5py']
+
+IMPORT_SCRIPT = '''
+import sys, time, json
+start = time.perf_counter()
+import {module}
+print(json.dumps({{
+    'seconds': time.perf_counter() - start,
+    'loaded': [m for m in {lazy_modules!r} if m in sys.modules]
+}}))
+'''
+
+FIRST_FRAME_SCRIPT = '''
+import sys, time, json
+start = time.perf_counter()
+from spectview.window import Window
+window = Window()
+window.fig.canvas.draw()
+print(json.dumps({{
+    'seconds': time.perf_counter() - start,
+    'loaded': [m for m in {lazy_modules!r} if m in sys.modules]
+}}))
+'''
+
+
+def run_script(script):
+    environment = dict(os.environ, MPLBACKEND='Agg', PYTHONPATH=REPO_PATH)
+    start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, '-c', script], env=environment, cwd=REPO_PATH,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True
+    )
+    wall_time = time.perf_counter() - start
+    if output.returncode:
+        raise RuntimeError(output.stderr.strip().splitlines()[-1])
+    result = json.loads(output.stdout.strip().splitlines()[-1])
+    result['process_seconds'] = wall_time
+    return result
+
+
+def measure(name, script, repeat):
+    try:
+        results = [run_script(script) for _ in range(repeat)]
+    except RuntimeError as error:
+        print(f'{name:<28} failed: {error}')
+        return None
+
+    best = min(results, key=lambda result: result['seconds'])
+    print(
+        f'{name:<28} {1e3 * best["seconds"]:>9.0f} ms {1e3 * best["process_seconds"]:>9.0f} ms'
+        f'   {", ".join(best["loaded"]) or "-"}'
+    )
+    return best
+
+
+def run(repeat):
+    print(f'{"":<28} {"in python":>12} {"process":>12}   eagerly loaded')
+    return {
+        'import_window': measure(
+            'import spectview.window',
+            IMPORT_SCRIPT.format(module='spectview.window', lazy_modules=LAZY_MODULES), repeat
+        ),
+        'import_batch': measure(
+            'import spectview.batch',
+            IMPORT_SCRIPT.format(module='spectview.batch', lazy_modules=LAZY_MODULES), repeat
+        ),
+        'first_frame': measure(
+            'first frame (Agg)', FIRST_FRAME_SCRIPT.format(lazy_modules=LAZY_MODULES), repeat
+        ),
+    }
+
+
+def compare_loaded(loaded, baseline_loaded):
+    # True if no case loads more of the lazy modules than in the baseline
+    is_ok = True
+    for name, modules in loaded.items():
+        eager = sorted(set(modules) - set(baseline_loaded.get(name, modules)))
+        if eager:
+            is_ok = False
+            print(f'{name:<28} loads {", ".join(eager)} eagerly  REGRESSION')
+    return is_ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure the spectview start up time.')
+    parser.add_argument('--save', help='save the results as the JSON baseline')
+    parser.add_argument('--compare', help='compare the results with the JSON baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative slow down')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    measured = {name: best for name, best in run(args.repeat).items() if best is not None}
+    results = {name: best['seconds'] for name, best in measured.items()}
+    loaded = {name: best['loaded'] for name, best in measured.items()}
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'machine': platform.platform(), 'python': platform.python_version(),
+                       'results': results, 'loaded': loaded}, f, indent=2, sort_keys=True)
+        print(f'The baseline saved to the {args.save} file.')
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        is_ok = compare(results, baseline['results'], args.tolerance)
+        is_ok = compare_loaded(loaded, baseline.get('loaded', {})) and is_ok
+        return 0 if is_ok else 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
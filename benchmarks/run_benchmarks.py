@@ -0,0 +1,182 @@
+#!/usr/bin/python3
+# Benchmarks of the hot paths on synthetic spectra (4096 - 65536 bins, 1 - 20 peaks):
+# loading, fitting, y autoscale and plotting.
+#
+# usage: python3 benchmarks/run_benchmarks.py --save baseline.json
+#        python3 benchmarks/run_benchmarks.py --compare baseline.json [--tolerance 0.25]
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import platform
+
+os.environ.setdefault('MPLBACKEND', 'Agg')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+from lmfit.lineshapes import gaussian
+
+import spectview.settings as settings
+from spectview.datatypes import DataSet, GateInfo, Peak
+from spectview.peak_fitter import PeakFitter
+
+SPECTRUM_BINS = (4096, 16384, 65536)
+PEAKS_NUMBERS = (1, 5, 20)
+PEAK_SPACING = 8
+PEAK_WIDTH = 1.5
+
+
+def synthetic_spectrum(n_bins, n_peaks, seed=0):
+    # exponential background with a group of gaussian peaks in the middle
+    random_state = np.random.RandomState(seed)
+    data_x = np.arange(n_bins)
+    expected = 200 * np.exp(-data_x / (n_bins / 4)) + 5
+
+    first_centroid = n_bins // 2
+    centroids = first_centroid + PEAK_SPACING * np.arange(n_peaks) + random_state.uniform(-1, 1, n_peaks)
+    for centroid in centroids:
+        expected += gaussian(data_x, random_state.uniform(500, 5000), centroid, PEAK_WIDTH)
+    return random_state.poisson(expected), centroids
+
+
+def fit_region(data_y, centroids):
+    start = int(centroids[0]) - 4 * PEAK_SPACING
+    stop = int(centroids[-1]) + 4 * PEAK_SPACING
+    data_x = np.arange(start, stop)
+    peaks = [Peak(centroid + 0.3, data_y[int(round(centroid))]) for centroid in centroids]
+    return data_x, data_y[start:stop], peaks
+
+
+def timeit(function, repeat, number=1):
+    # the best time of one call
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        timings.append((time.perf_counter() - start) / number)
+    return min(timings)
+
+
+def bench_load(results, work_dir, repeat):
+    use_cache, cache_path = settings.USE_SPECTRUM_CACHE, settings.SPECTRUM_CACHE_PATH
+    settings.SPECTRUM_CACHE_PATH = os.path.join(work_dir, 'cache')
+    try:
+        for n_bins in SPECTRUM_BINS:
+            data_y, _ = synthetic_spectrum(n_bins, 1)
+            file = os.path.join(work_dir, f'gate_g{n_bins}.txt')
+            with open(file, 'w') as f:
+                f.write('# File synthetic.h5, Ge-Ge, gate y=[1.0, 2.0],\n')
+                f.write('\n'.join(str(y) for y in data_y) + '\n')
+
+            settings.USE_SPECTRUM_CACHE = False
+            results[f'from_txt/parse/{n_bins}'] = timeit(lambda: DataSet.from_txt(file), repeat)
+            settings.USE_SPECTRUM_CACHE = True
+            DataSet.from_txt(file)
+            results[f'from_txt/cached/{n_bins}'] = timeit(lambda: DataSet.from_txt(file), repeat, number=10)
+    finally:
+        settings.USE_SPECTRUM_CACHE, settings.SPECTRUM_CACHE_PATH = use_cache, cache_path
+
+
+def bench_fit(results, repeat):
+    for n_peaks in PEAKS_NUMBERS:
+        data_y, centroids = synthetic_spectrum(4096, n_peaks)
+        data_x, data_y, peaks = fit_region(data_y, centroids)
+
+        def do_fit():
+            peak_fit = PeakFitter(data_x=data_x, data_y=data_y, peaks=peaks)
+            peak_fit.do_fit()
+            return peak_fit
+
+        results[f'do_fit/{n_peaks}'] = timeit(do_fit, repeat)
+        peak_fit = do_fit()
+        results[f'get_result/{n_peaks}'] = timeit(peak_fit.get_result, repeat, number=10)
+
+
+def bench_window(results, repeat):
+    import matplotlib.pyplot as plt
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from spectview.plot_utils import PlotManager
+    from spectview.window import Window
+
+    for n_bins in SPECTRUM_BINS:
+        data_y, centroids = synthetic_spectrum(n_bins, 5)
+        dataset = DataSet(spectrum=data_y, gate=GateInfo(f'gate_g{n_bins}.txt'))
+
+        window = Window()
+        window.add_dataset(dataset)
+        window.ax.set_xlim(centroids[0] - 200, centroids[0] + 200)
+        results[f'y_axis_autoscale/{n_bins}'] = timeit(window._y_axis_autoscale, repeat, number=100)
+        plt.close(window.fig)
+
+        def add_plot_and_draw():
+            figure = Figure(figsize=settings.FIGURE_SIZE)
+            canvas = FigureCanvasAgg(figure)
+            plot_manager = PlotManager(window_object=type('Window', (), {'ax': figure.add_subplot(111)}))
+            plot_manager.plot_setup = settings.SPECTRUM_PLOT_SETUP
+            plot_manager.add_plot('spectrum', *dataset.get_spectrum())
+            canvas.draw()
+
+        results[f'add_plot_draw/{n_bins}'] = timeit(add_plot_and_draw, repeat)
+
+
+def run(repeat):
+    results = {}
+    work_dir = tempfile.mkdtemp(prefix='spectview_bench_')
+    try:
+        bench_load(results, work_dir, repeat)
+        bench_fit(results, repeat)
+        bench_window(results, repeat)
+    finally:
+        shutil.rmtree(work_dir)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    # True if no benchmark is slower than the baseline by more than the tolerance
+    is_ok = True
+    print(f'{"benchmark":<28} {"baseline [ms]":>14} {"now [ms]":>10} {"ratio":>7}')
+    for name, seconds in results.items():
+        if name not in baseline:
+            print(f'{name:<28} {"-":>14} {1e3 * seconds:>10.3f}')
+            continue
+        ratio = seconds / baseline[name]
+        is_regression = ratio > 1 + tolerance
+        is_ok = is_ok and not is_regression
+        print(f'{name:<28} {1e3 * baseline[name]:>14.3f} {1e3 * seconds:>10.3f} {ratio:>6.2f}x'
+              + ('  REGRESSION' if is_regression else ''))
+    return is_ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the spectview benchmarks.')
+    parser.add_argument('--save', help='save the results as the JSON baseline')
+    parser.add_argument('--compare', help='compare the results with the JSON baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative slow down')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    results = run(args.repeat)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'machine': platform.platform(), 'python': platform.python_version(),
+                       'results': results}, f, indent=2, sort_keys=True)
+        print(f'The baseline saved to the {args.save} file.')
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        return 0 if compare(results, baseline, args.tolerance) else 1
+
+    for name, seconds in results.items():
+        print(f'{name:<28} {1e3 * seconds:>10.3f} ms')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,41 @@
+import numpy as np
+
+import spectview.settings as settings
+
+
+def _lls(spectrum):
+    # log-log-square root transformation, it flattens the peaks of different heights
+    return np.log(np.log(np.sqrt(np.maximum(spectrum, 0) + 1) + 1) + 1)
+
+
+def _inverse_lls(values):
+    return (np.exp(np.exp(values) - 1) - 1)**2 - 1
+
+
+def _smooth(values, half_width):
+    # moving average over 2*half_width + 1 bins
+    window = 2 * half_width + 1
+    cumsum = np.cumsum(np.concatenate(([0.0], np.pad(values, half_width, mode='edge'))))
+    return (cumsum[window:] - cumsum[:-window]) / window
+
+
+def snip(spectrum, iterations=None, smoothing=None, lls=True):
+    # Statistics-sensitive Non-linear Iterative Peak-clipping: every bin is replaced
+    # by the mean of its p-th neighbours if it is lower, for p = 1 ... iterations,
+    # each pass over the whole spectrum at once; the smoothing lowers the bias
+    # of the clipping to the bottom of the statistical fluctuations
+    iterations = iterations or settings.SNIP_ITERATIONS
+    smoothing = settings.SNIP_SMOOTHING if smoothing is None else smoothing
+    values = np.array(spectrum, dtype=float)
+    if smoothing:
+        values = _smooth(values, smoothing)
+    if lls:
+        values = _lls(values)
+
+    for p in range(1, min(iterations, (len(values) - 1) // 2) + 1):
+        neighbours_mean = 0.5 * (values[:-2 * p] + values[2 * p:])
+        np.minimum(values[p:-p], neighbours_mean, out=values[p:-p])
+
+    if lls:
+        values = _inverse_lls(values)
+    return np.maximum(values, 0)
@@ -0,0 +1,218 @@
+#!/usr/bin/python3
+# Headless batch fitting (no matplotlib/tkinter needed).
+#
+# The manifest is a JSON file:
+# {
+#     "output": "fits/batch_fit_results.csv",
+#     "jobs": [
+#         {"file": "examples/gate_g1436g444.txt", "range": [420, 470], "peaks": [444, [452, 30]]}
+#     ]
+# }
+# The range, the peaks and the energies are in the x units of the spectrum: keV
+# when it has a calibration (a .cal file next to it or CALIBRATION_FILE), bins otherwise.
+# Every peak is given by its initial centroid or by [centroid, amplitude]. When
+# the amplitude is missing the number of counts in the centroid bin is used.
+# "peaks": "auto" fits the peaks found by the automatic peak search in the range.
+# "background": "snip" fits the peaks over the fixed SNIP background and a free offset (optionally
+# with "snip_iterations") instead of the linear one.
+# "fwhm": [a, b, c] (FWHM^2 = a + b*x + c*x^2, FWHM_CALIBRATION by default) makes
+# the widths follow the calibration times a common scale ("free_width_scale": false
+# fixes it); "energies": [E or null for every peak] ties the centroids to the known
+# energies moved by one common shift.
+# "bootstrap": N adds the percentile intervals (BOOTSTRAP_CONFIDENCE) of the
+# centroids and areas from N fits of the Poisson resampled spectrum.
+# "files": [...] in place of "file" fits the range in all the spectra at once
+# (global fit), the centroids and widths are shared and the areas are fitted
+# for every spectrum.
+#
+# usage: python3 -m spectview.batch manifest.json [-o results.json] [-j 4] [--db results.sqlite]
+import os
+import sys
+import csv
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from spectview.datatypes import DataSet, Peak
+from spectview.peak_fitter import PeakFitter
+from spectview.peak_search import find_peaks
+from spectview.bootstrap import bootstrap
+from spectview.global_fitter import GlobalPeakFitter
+from spectview.results_store import ResultsStore, fit_rows
+import spectview.settings as settings
+
+OUTPUT_FIELDS = [
+    'job', 'file', 'gate', 'range_low', 'range_high', 'peak',
+    'centroid', 'centroid_err', 'area', 'area_err', 'sigma', 'sigma_err',
+    'chisqr', 'redchi', 'nfev', 'success', 'error',
+    'centroid_low', 'centroid_high', 'area_low', 'area_high'
+]
+
+
+def read_manifest(manifest_file):
+    with open(manifest_file) as f:
+        manifest = json.load(f)
+
+    # relative spectra paths are resolved against the manifest directory
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_file))
+    for i, job in enumerate(manifest['jobs']):
+        job.setdefault('job', i)
+        # the malformed jobs are reported by run_job as the error rows
+        if isinstance(job.get('files'), list) and all(isinstance(file, str) for file in job['files']):
+            job['files'] = [os.path.join(manifest_dir, file) for file in job['files']]
+        elif isinstance(job.get('file'), str):
+            job['file'] = os.path.join(manifest_dir, job['file'])
+    return manifest
+
+
+def range_slicing(dataset, x_range):
+    # bins of the [low, high) range given in the x units of the spectrum
+    data_x = dataset.get_spectrum()[0]
+    return np.searchsorted(data_x, sorted(x_range)).tolist()
+
+
+def job_peaks(job, data_x, data_y):
+    if job['peaks'] == 'auto':
+        # the job without peaks would give no rows at all
+        peaks = find_peaks(data_y, data_x=data_x)
+        if not peaks:
+            raise ValueError('No peaks found in the range.')
+        return peaks
+
+    peaks = []
+    for peak in job['peaks']:
+        if isinstance(peak, (int, float)):
+            centroid = peak
+            amp = data_y[np.abs(data_x - centroid).argmin()]
+        else:
+            centroid, amp = peak
+        peaks.append(Peak(centroid, amp))
+    return peaks
+
+
+def error_rows(row, files, error):
+    return [dict(row, file=file, error=f'{type(error).__name__}: {error}') for file in files]
+
+
+def run_global_job(job):
+    row = {'job': job.get('job')}
+    files = job['files'] if isinstance(job['files'], list) and job['files'] else [job['files']]
+    try:
+        row['range_low'], row['range_high'] = job['range']
+        if not isinstance(job['files'], list) or not all(isinstance(file, str) for file in files):
+            raise TypeError(f'Wrong files of the job: {job["files"]}.')
+        datasets = [DataSet.from_file(file) for file in files]
+        slicings = [range_slicing(dataset, job['range']) for dataset in datasets]
+        spectra = [dataset.get_spectrum(slicing=slicing) for dataset, slicing in zip(datasets, slicings)]
+        backgrounds = [
+            dataset.get_background(slicing=slicing, iterations=job.get('snip_iterations'))
+            if job.get('background', settings.FIT_BACKGROUND) == 'snip' else None
+            for dataset, slicing in zip(datasets, slicings)
+        ]
+        # the initial peaks are taken from the first spectrum
+        global_fit = GlobalPeakFitter(
+            spectra, job_peaks(job, *spectra[0]), backgrounds=backgrounds,
+            names=[repr(dataset.gate) for dataset in datasets]
+        )
+        global_fit.do_fit()
+    except (OSError, KeyError, TypeError, ValueError, IndexError, np.linalg.LinAlgError) as error:
+        return error_rows(row, files, error)
+
+    return [
+        fit_row for file, spectrum_fit in zip(files, global_fit.spectrum_fits)
+        for fit_row in fit_rows(spectrum_fit, file=file, gate=spectrum_fit.name, **row)
+    ]
+
+
+def run_job(job):
+    # every job gives its rows, the malformed ones (e.g. without the range) an error row
+    if 'files' in job:
+        return run_global_job(job)
+
+    row = {'job': job.get('job')}
+    try:
+        row['range_low'], row['range_high'] = job['range']
+        if not isinstance(job['file'], str):
+            raise TypeError(f'Wrong file of the job: {job["file"]}.')
+        row['file'] = job['file']
+        dataset = DataSet.from_file(job['file'])
+        row['gate'] = repr(dataset.gate)
+        slicing = range_slicing(dataset, job['range'])
+        data_x, data_y = dataset.get_spectrum(slicing=slicing)
+
+        background = None
+        if job.get('background', settings.FIT_BACKGROUND) == 'snip':
+            background = dataset.get_background(slicing=slicing, iterations=job.get('snip_iterations'))
+
+        peak_fit = PeakFitter(
+            data_x=data_x, data_y=data_y, peaks=job_peaks(job, data_x, data_y), background=background,
+            fwhm_calibration=job.get('fwhm', settings.FWHM_CALIBRATION), energies=job.get('energies'),
+            free_width_scale=job.get('free_width_scale', settings.FIT_FREE_WIDTH_SCALE)
+        )
+        peak_fit.do_fit()
+
+        rows = fit_rows(peak_fit, **row)
+        if job.get('bootstrap'):
+            # the jobs already run in parallel, so the resampled fits of one job don't
+            # start worker processes of their own
+            intervals = bootstrap(peak_fit, n_samples=job['bootstrap'], max_workers=1).intervals()
+            for fit_row, peak in zip(rows, intervals):
+                fit_row.update(
+                    (name, peak[name]) for name in ('centroid_low', 'centroid_high', 'area_low', 'area_high')
+                )
+    except (OSError, KeyError, TypeError, ValueError, IndexError) as error:
+        return error_rows(row, [job.get('file')], error)
+    return rows
+
+
+def run_jobs(jobs, max_workers=None):
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return [row for rows in executor.map(run_job, jobs, chunksize=4) for row in rows]
+
+
+def save_results(rows, output_file):
+    output_dir = os.path.dirname(output_file)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    if output_file.endswith('.json'):
+        with open(output_file, 'w') as f:
+            json.dump(rows, f, indent=2)
+    else:
+        with open(output_file, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=OUTPUT_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fit peaks listed in the manifest file.')
+    parser.add_argument('manifest', help='JSON file with the list of fit jobs')
+    parser.add_argument('-o', '--output', help='output .csv or .json file')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of worker processes')
+    parser.add_argument(
+        '--db', nargs='?', const=settings.RESULTS_DATABASE,
+        help='also store the results in the SQLite database (RESULTS_DATABASE without the file)'
+    )
+    args = parser.parse_args(argv)
+
+    manifest = read_manifest(args.manifest)
+    output_file = args.output or manifest.get('output') or os.path.join(
+        settings.OUTPUT_FIT_RESULTS_PATH, 'batch_fit_results.csv'
+    )
+
+    rows = run_jobs(manifest['jobs'], max_workers=args.jobs)
+    save_results(rows, output_file)
+    if args.db:
+        with ResultsStore(args.db) as store:
+            store.add_fits(rows)
+
+    failed = sum(1 for row in rows if row.get('error'))
+    print(f'{len(manifest["jobs"])} jobs done ({failed} failed). The results saved to the {output_file} file.')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,122 @@
+import os
+import copy
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import spectview.settings as settings
+
+
+def _resampling_fitter(peak_fit):
+    # copy of the fitter without the fit result (it can hold e.g. the
+    # cancellation callback), which starts from the best fit parameters
+    resampling_fit = copy.copy(peak_fit)
+    resampling_fit.params = peak_fit.result.params.copy()
+    resampling_fit.result = None
+    resampling_fit.init = None
+    resampling_fit.fit = None
+    return resampling_fit
+
+
+def _fit_samples(job):
+    # centroids, areas and widths (rows are samples, columns are peaks) of the fits
+    # of the Poisson resampled spectra, nan for the failed fits
+    peak_fit, seed, n_samples = job
+    rng = np.random.default_rng(seed)
+    data_y = np.asarray(peak_fit.data_y, dtype=float)
+    expected = np.maximum(data_y, 0)
+    values = np.full((3, n_samples, len(peak_fit.peaks)), np.nan)
+    for k in range(n_samples):
+        if peak_fit.sigma is None:
+            resampled = rng.poisson(expected).astype(float)
+        else:
+            # the derived spectra (e.g. gate - k*bg) are not Poisson, their errors are used
+            resampled = data_y + rng.normal(scale=peak_fit.sigma)
+        try:
+            peak_arrays = peak_fit.refit(resampled, params=peak_fit.params)
+        except (ValueError, TypeError, np.linalg.LinAlgError):
+            continue
+        if peak_arrays is None:
+            continue
+        amp, cen, wid = peak_arrays
+        values[:, k] = cen, amp / peak_fit.bin_width, wid
+    return values
+
+
+def bootstrap(peak_fit, n_samples=None, max_workers=None, seed=None, mp_context=None, progress_cb=None):
+    # centroids, areas and widths of the refits of n_samples Poisson resampled
+    # spectra (each one started from the best fit), the samples are split in a few
+    # chunks per worker process; progress_cb(n_done) is called after every chunk
+    # and True stops the bootstrap (None is returned)
+    n_samples = n_samples or settings.BOOTSTRAP_SAMPLES
+    max_workers = max_workers or settings.BOOTSTRAP_WORKERS or os.cpu_count() or 1
+    n_chunks = min(4 * max_workers, n_samples) if max_workers > 1 else 1
+    seeds = np.random.SeedSequence(seed).spawn(n_chunks)
+    resampling_fit = _resampling_fitter(peak_fit)
+    jobs = [
+        (resampling_fit, chunk_seed, len(chunk))
+        for chunk_seed, chunk in zip(seeds, np.array_split(np.arange(n_samples), n_chunks))
+    ]
+
+    parts = []
+    if n_chunks == 1:
+        parts = list(map(_fit_samples, jobs))
+        if progress_cb is not None and progress_cb(n_samples):
+            return None
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context) as executor:
+            futures = [executor.submit(_fit_samples, job) for job in jobs]
+            for future in futures:
+                parts.append(future.result())
+                if progress_cb is not None and progress_cb(sum(part.shape[1] for part in parts)):
+                    executor.shutdown(cancel_futures=True)
+                    return None
+    centroids, areas, sigmas = np.concatenate(parts, axis=1)
+    return BootstrapResult(peak_fit, centroids, areas, sigmas)
+
+
+class BootstrapResult:
+
+    def __init__(self, peak_fit, centroids, areas, sigmas):
+        self.peak_fit = peak_fit
+        self.centroids = centroids
+        self.areas = areas
+        self.sigmas = sigmas
+
+    @property
+    def n_samples(self):
+        return len(self.centroids)
+
+    @property
+    def n_failed(self):
+        return int(np.isnan(self.centroids[:, 0]).sum()) if self.centroids.size else 0
+
+    def intervals(self, confidence=None):
+        # best fit values and the percentile intervals of every peak
+        confidence = confidence or settings.BOOTSTRAP_CONFIDENCE
+        percentiles = [50 * (1 - confidence), 50 * (1 + confidence)]
+        output = []
+        for i, peak in enumerate(self.peak_fit.get_peaks_parameters()):
+            row = {'centroid': peak['centroid'], 'area': peak['area'], 'sigma': peak['sigma']}
+            for name, samples in (('centroid', self.centroids), ('area', self.areas), ('sigma', self.sigmas)):
+                good = samples[:, i][~np.isnan(samples[:, i])]
+                low, high = np.percentile(good, percentiles) if len(good) else (None, None)
+                row[f'{name}_low'] = None if low is None else float(low)
+                row[f'{name}_high'] = None if high is None else float(high)
+            output.append(row)
+        return output
+
+    def generate_report(self, confidence=None):
+        confidence = confidence or settings.BOOTSTRAP_CONFIDENCE
+        resampling = 'Poisson' if self.peak_fit.sigma is None else 'Gaussian'
+        report = (
+            f'\n[[Bootstrap]] {self.n_samples} {resampling} resampled fits ({self.n_failed} failed), '
+            f'{100 * confidence:.1f}% intervals\n'
+        )
+        for i, peak in enumerate(self.intervals(confidence)):
+            report += (
+                f'    peak_{i}: cen = {peak["centroid"]:.4f} [{peak["centroid_low"] or 0:.4f}, '
+                f'{peak["centroid_high"] or 0:.4f}], area = {peak["area"]:.1f} '
+                f'[{peak["area_low"] or 0:.1f}, {peak["area_high"] or 0:.1f}]\n'
+            )
+        return report
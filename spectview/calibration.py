@@ -0,0 +1,92 @@
+import os
+from functools import lru_cache
+
+import numpy as np
+from numpy.polynomial import polynomial
+
+import spectview.settings as settings
+
+
+class Calibration:
+    # E(bin) = c0 + c1*bin + c2*bin**2 + ...
+    # the calibrated axes are computed once for every spectrum length
+
+    def __init__(self, coefficients=(0.0, 1.0)):
+        self.coefficients = np.array(coefficients, dtype=float)
+        if self.coefficients.ndim != 1 or len(self.coefficients) < 2 or not self.coefficients[1:].any():
+            raise ValueError(f'Wrong calibration coefficients: {coefficients}.')
+        self._axes = {}
+
+    def __repr__(self):
+        return 'Calibration({})'.format(', '.join(f'{c:.6g}' for c in self.coefficients))
+
+    @property
+    def is_linear(self):
+        return not self.coefficients[2:].any()
+
+    @classmethod
+    def from_file(cls, file):
+        # coefficients c0 c1 ... separated by white spaces, '#' starts a comment
+        return _calibration_from_file(os.path.abspath(file), os.stat(file).st_mtime_ns)
+
+    @classmethod
+    def from_peaks(cls, bins, energies, degree=None):
+        bins = np.asarray(bins, dtype=float)
+        energies = np.asarray(energies, dtype=float)
+        if bins.shape != energies.shape:
+            raise ValueError(f'{len(bins)} peaks but {len(energies)} energies given.')
+        if len(bins) < 2:
+            raise ValueError('At least two peaks are needed for the calibration.')
+
+        degree = min(degree or settings.CALIBRATION_DEGREE, len(bins) - 1)
+        return cls(polynomial.polyfit(bins, energies, degree))
+
+    @classmethod
+    def for_spectrum(cls, file):
+        # the '<spectrum name>.cal' file next to the spectrum or the default CALIBRATION_FILE
+        for calibration_file in (os.path.splitext(file)[0] + '.cal', settings.CALIBRATION_FILE):
+            if calibration_file and os.path.isfile(calibration_file):
+                return cls.from_file(calibration_file)
+        return None
+
+    def save(self, file):
+        with open(file, 'w') as f:
+            f.write('# E(bin) = c0 + c1*bin + c2*bin^2 + ...\n')
+            f.write(' '.join(repr(float(c)) for c in self.coefficients) + '\n')
+
+    def axis(self, n_bins):
+        axis = self._axes.get(n_bins)
+        if axis is None:
+            axis = self.bin_to_energy(np.arange(n_bins))
+            axis.setflags(write=False)
+            self._axes[n_bins] = axis
+        return axis
+
+    def rebinned(self, factor):
+        # calibration of the spectrum with every `factor` bins summed: the new bin b
+        # is centered at the old bin factor*b + (factor - 1)/2
+        centers = polynomial.Polynomial([(factor - 1) / 2, factor])
+        return Calibration(polynomial.Polynomial(self.coefficients)(centers).coef)
+
+    def bin_to_energy(self, bins):
+        return polynomial.polyval(np.asarray(bins, dtype=float), self.coefficients)
+
+    def energy_to_bin(self, energies, n_bins):
+        energies = np.asarray(energies, dtype=float)
+        c0, c1 = self.coefficients[:2]
+        if self.is_linear:
+            return (energies - c0) / c1
+
+        axis = self.axis(n_bins)
+        if np.any(np.diff(axis) <= 0):
+            raise ValueError(f'{self} is not increasing in the range of {n_bins} bins.')
+        bins = np.interp(energies, axis, np.arange(n_bins, dtype=float))
+        # one Newton step from the linear interpolation
+        derivative = polynomial.polyval(bins, polynomial.polyder(self.coefficients))
+        return bins - (self.bin_to_energy(bins) - energies) / derivative
+
+
+@lru_cache(maxsize=32)
+def _calibration_from_file(file, mtime_ns):
+    # one calibration (with its cached axes) per unchanged file
+    return Calibration(np.loadtxt(file, ndmin=1).ravel())
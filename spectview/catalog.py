@@ -0,0 +1,136 @@
+#!/usr/bin/python3
+# Catalog of the spectra files of a directory indexed by the gate type and the
+# gamma energies read from the file names (e.g. gate_g1436g444.txt), the found
+# spectra are loaded by a thread pool into the shared dataset store.
+#
+# usage: python3 -m spectview.catalog spectra/ 1436 444 [--type gate] [--tolerance 2] [--show]
+import os
+import sys
+import argparse
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from spectview.datatypes import DataSet, GateInfo
+from spectview.dataset_store import dataset_store
+import spectview.settings as settings
+
+CATALOG_EXTENSIONS = ('.txt', '.h5')
+
+
+def parse_query(text):
+    # e.g. 'gate 1436 & 444' or 'bg 539' -> gammas, gate type
+    gammas, type_ = [], None
+    for word in text.replace('&', ' ').replace(',', ' ').split():
+        if word in ('gate', 'bg'):
+            type_ = word
+        else:
+            gammas.append(float(word))
+    return gammas, type_
+
+
+class SpectrumCatalog:
+
+    def __init__(self, directory, recursive=False):
+        self.directory = directory
+        self.recursive = recursive
+        self.files = []
+        self.gates = []
+        self._by_type = defaultdict(set)
+        self._gamma_values = np.empty(0)
+        self._gamma_files = np.empty(0, dtype=np.intp)
+        self.scan()
+
+    def __len__(self):
+        return len(self.files)
+
+    def _list_files(self):
+        if self.recursive:
+            for root, _, names in os.walk(self.directory):
+                for name in names:
+                    yield os.path.join(root, name)
+        else:
+            for entry in os.scandir(self.directory):
+                if entry.is_file():
+                    yield entry.path
+
+    def scan(self):
+        # only the file names are read, not the spectra
+        self.files = sorted(file for file in self._list_files() if file.endswith(CATALOG_EXTENSIONS))
+        self.gates = [GateInfo(filename=file) for file in self.files]
+
+        self._by_type.clear()
+        gamma_values, gamma_files = [], []
+        for i, gate in enumerate(self.gates):
+            self._by_type[gate.type_].add(i)
+            gamma_values += gate.gammas_list
+            gamma_files += [i] * len(gate.gammas_list)
+
+        # sorted gammas, so the files of a gamma window are one slice of them
+        order = np.argsort(gamma_values, kind='stable')
+        self._gamma_values = np.asarray(gamma_values, dtype=float)[order]
+        self._gamma_files = np.asarray(gamma_files, dtype=np.intp)[order]
+
+    def _files_with_gamma(self, gamma, tolerance):
+        start = np.searchsorted(self._gamma_values, gamma - tolerance)
+        stop = np.searchsorted(self._gamma_values, gamma + tolerance, side='right')
+        return set(self._gamma_files[start:stop].tolist())
+
+    def find(self, gammas=(), type_=None, tolerance=None):
+        # files with all the gammas (within the tolerance) of the gate type (any if None)
+        tolerance = settings.CATALOG_TOLERANCE if tolerance is None else tolerance
+        found = set(self._by_type[type_]) if type_ else set(range(len(self.files)))
+        for gamma in gammas:
+            found &= self._files_with_gamma(gamma, tolerance)
+        return [self.files[i] for i in sorted(found)]
+
+    def load(self, files, max_workers=None):
+        # the datasets are kept in the dataset store (owned by the catalog),
+        # so the windows get them without loading
+        max_workers = max_workers or settings.CATALOG_LOAD_WORKERS
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(
+                lambda file: dataset_store.acquire(file, owner=self, loader=DataSet.from_file), files
+            ))
+
+    def load_all(self, max_workers=None):
+        return self.load(self.files, max_workers=max_workers)
+
+    def release(self, files):
+        for file in files:
+            dataset_store.release(file, owner=self)
+
+    def close(self):
+        dataset_store.release_all(self)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Find the spectra by their gammas.')
+    parser.add_argument('directory')
+    parser.add_argument('gammas', nargs='*', type=float)
+    parser.add_argument('--type', choices=['gate', 'bg'], default=None)
+    parser.add_argument('-t', '--tolerance', type=float, default=None)
+    parser.add_argument('-r', '--recursive', action='store_true')
+    parser.add_argument('--show', action='store_true', help='plot the found spectra')
+    args = parser.parse_args(argv)
+
+    catalog = SpectrumCatalog(args.directory, recursive=args.recursive)
+    files = catalog.find(args.gammas, type_=args.type, tolerance=args.tolerance)
+    for file in files:
+        print(file)
+    print(f'{len(files)} of {len(catalog)} spectra found.')
+
+    if args.show and files:
+        import matplotlib.pyplot as plt
+        from spectview.window import Window
+
+        window = Window(show=False)
+        window.catalog = catalog
+        window.add_datasets_from_files(files)
+        plt.show()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
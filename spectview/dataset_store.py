@@ -0,0 +1,82 @@
+import os
+import threading
+import weakref
+
+
+class DatasetStore:
+    # process-wide registry of the loaded spectra: every file is loaded once,
+    # its spectrum is read-only and shared by all the windows which use it;
+    # a dataset is dropped when the last window releases it (or is garbage collected)
+
+    def __init__(self):
+        self._datasets = {}
+        # weak references, so the owners which were never released don't keep the datasets
+        self._owners = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(file):
+        # as in the spectrum cache: a re-exported file is another dataset
+        path = os.path.abspath(file)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return path, None, None
+        return path, stat.st_mtime_ns, stat.st_size
+
+    def _drop_unowned(self):
+        for key in [key for key, owners in self._owners.items() if not owners]:
+            del self._owners[key]
+            del self._datasets[key]
+
+    def acquire(self, file, owner, loader):
+        key = self._key(file)
+        with self._lock:
+            self._drop_unowned()
+            dataset = self._datasets.get(key)
+            if dataset is not None:
+                self._owners[key].add(owner)
+                return dataset
+
+        # the file is loaded outside of the lock, so other files can be loaded meanwhile
+        dataset = loader(file)
+        if dataset is None:
+            return None
+        if hasattr(dataset.spectrum, 'setflags'):
+            dataset.spectrum.setflags(write=False)
+
+        with self._lock:
+            dataset = self._datasets.setdefault(key, dataset)
+            self._owners.setdefault(key, weakref.WeakSet()).add(owner)
+            return dataset
+
+    def release(self, file, owner):
+        # every version of the file the owner has acquired
+        path = os.path.abspath(file)
+        with self._lock:
+            for key, owners in self._owners.items():
+                if key[0] == path:
+                    owners.discard(owner)
+            self._drop_unowned()
+
+    def release_all(self, owner):
+        with self._lock:
+            for owners in self._owners.values():
+                owners.discard(owner)
+            self._drop_unowned()
+
+    def users(self, file):
+        return len(self._owners.get(self._key(file), ()))
+
+    def __contains__(self, file):
+        with self._lock:
+            self._drop_unowned()
+            return self._key(file) in self._datasets
+
+    def __len__(self):
+        with self._lock:
+            self._drop_unowned()
+            return len(self._datasets)
+
+
+dataset_store = DatasetStore()
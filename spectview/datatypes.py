@@ -2,13 +2,27 @@ import re
 import os
 import numpy as np
 
+from spectview.background import snip
+from spectview.calibration import Calibration
+from spectview.hdf5_matrix import HDF5Matrix
+from spectview.spectrum_cache import load_spectrum, read_header
+import spectview.settings as settings
+
 
 class GateInfo:
+    # e.g. '# File th232_ggg.h5, Ge-Ge-Ge, gate z=[1434.0, 1438.0], gate y=[442.05, 445.95],'
+    HEADER_PATTERN = re.compile(r'File\s+(?P<source_file>[^,]+),\s*(?P<detectors>[^,]+),')
+    GATE_WINDOW_PATTERN = re.compile(r'gate\s+(?P<axis>[zy])\s*=\s*\[(?P<low>[^,\]]+),(?P<high>[^\]]+)\]')
 
-    def __init__(self, filename: str):
+    def __init__(self, filename: str, gate_z=None, gate_y=None, source_file=None, detectors=None):
         self.filename = filename
         self.type_ = self.read_gate_type_from_filename()
         self.gammas_list = [int(x[1:]) for x in re.findall('g\d+', os.path.basename(self.filename))]
+        # gate windows [low, high] on the z and y axes of the source matrix
+        self.gate_z = gate_z
+        self.gate_y = gate_y
+        self.source_file = source_file
+        self.detectors = detectors
 
     def __repr__(self):
         return self.filename.split('/')[-1].split('.')[0]
@@ -16,36 +30,155 @@ class GateInfo:
     def __str__(self):
         return self.type_+' '+' - '.join([str(x) for x in self.gammas_list])
 
+    @classmethod
+    def from_gate_windows(cls, file, gate_z=None, gate_y=None, type_='gate'):
+        # name the projection like the exported spectra, e.g. gate_g1436g444
+        gammas = ''.join(
+            'g{}'.format(int(round(sum(window) / 2))) for window in (gate_z, gate_y) if window
+        )
+        if not gammas:
+            type_ = 'projection'
+            gammas = os.path.splitext(os.path.basename(file))[0]
+        name = os.path.join(os.path.dirname(file), f'{type_}_{gammas}.h5')
+        return cls(filename=name, gate_z=gate_z, gate_y=gate_y)
+
+    @classmethod
+    def from_header(cls, filename, header):
+        gate_info = cls(filename=filename)
+        for line in header:
+            match = cls.HEADER_PATTERN.search(line)
+            if match:
+                gate_info.source_file = match.group('source_file').strip()
+                gate_info.detectors = match.group('detectors').strip()
+
+            for match in cls.GATE_WINDOW_PATTERN.finditer(line):
+                try:
+                    window = [float(match.group('low')), float(match.group('high'))]
+                except ValueError:
+                    continue
+                setattr(gate_info, 'gate_' + match.group('axis'), window)
+        return gate_info
+
     def read_gate_type_from_filename(self):
-        if 'gate' in self.filename:
+        # only the file name, the directories (e.g. gates/) don't tell the type
+        name = os.path.basename(self.filename)
+        if 'gate' in name:
             return 'gate'
-        elif 'bg' in self.filename:
+        elif 'bg' in name:
             return 'bg'
 
 
+class Peak:
+    def __init__(self, centroid, amp):
+        self.centroid = centroid
+        self.amp = amp
+
+    def __repr__(self):
+        return f'Peak(cen={self.centroid:.2f}, amp={self.amp:.2f})'
+
+
 class DataSet:
 
-    def __init__(self, spectrum, gate):
+    def __init__(self, spectrum, gate, calibration=None, variance=None):
         self.spectrum = spectrum
         self.gate = gate
+        # bins to energy, x are the bin numbers without it
+        self.calibration = calibration
+        # variance of the counts of the derived spectra (e.g. gate - k*bg),
+        # None for the measured ones (Poisson)
+        self.variance = variance
+        # SNIP backgrounds of the spectrum by their parameters
+        self.backgrounds = {}
+        # incremented when the spectrum changes in place (e.g. a live spectrum)
+        self.version = 0
 
     @classmethod
-    def from_txt(cls, file):
-        spectrum = np.genfromtxt(file, dtype=int)
-        gate = GateInfo(filename=file)
-        return cls(spectrum=spectrum, gate=gate)
+    def from_txt(cls, file, calibration=None):
+        spectrum = load_spectrum(file)
+        gate = GateInfo.from_header(filename=file, header=read_header(file))
+        return cls(spectrum=spectrum, gate=gate, calibration=calibration or Calibration.for_spectrum(file))
 
+    @classmethod
+    def from_file(cls, file):
+        # the .h5 matrices and cubes (whole projections), the text spectra otherwise
+        if file.endswith('.h5'):
+            return cls.from_hdf5(file=file)
+        return cls.from_txt(file=file)
 
     @classmethod
-    def from_hdf5(cls, file):  # TODO: implement it!
-        pass
+    def from_hdf5(cls, file, gate_z=None, gate_y=None, type_='gate', calibration=None):
+        # one gate reads only the slabs it touches, the prefix sums of the Projector
+        # (projection.projector_for) pay off only for tuning the gate windows
+        with HDF5Matrix(file) as matrix:
+            spectrum = matrix.project(gate_z=gate_z, gate_y=gate_y)
+        gate = GateInfo.from_gate_windows(file, gate_z=gate_z, gate_y=gate_y, type_=type_)
+        gate.source_file = os.path.basename(file)
+        return cls(spectrum=spectrum, gate=gate, calibration=calibration or Calibration.for_spectrum(file))
+
+    def calibrated(self, calibration):
+        # the same (shared) spectrum with another calibration
+        dataset = type(self)(spectrum=self.spectrum, gate=self.gate, calibration=calibration, variance=self.variance)
+        # the background (in bins) does not depend on the calibration
+        dataset.backgrounds = self.backgrounds
+        return dataset
+
+    def get_background(self, slicing=None, iterations=None, smoothing=None, lls=True):
+        # computed once for the whole spectrum and every parameters set
+        key = (
+            iterations or settings.SNIP_ITERATIONS,
+            settings.SNIP_SMOOTHING if smoothing is None else smoothing,
+            lls
+        )
+        background = self.backgrounds.get(key)
+        if background is None:
+            background = snip(self.spectrum, *key)
+            background.setflags(write=False)
+            self.backgrounds[key] = background
+
+        if not slicing:
+            return background
+        return background[slice(*slicing)]
+
+    def without_background(self, iterations=None):
+        name, extension = os.path.splitext(self.gate.filename)
+        gate = GateInfo(filename=f'{name}_nobg{extension}', gate_z=self.gate.gate_z, gate_y=self.gate.gate_y,
+                        source_file=self.gate.source_file, detectors=self.gate.detectors)
+        # the background is taken as exact, the variance is the one of the spectrum
+        return type(self)(spectrum=self.spectrum - self.get_background(iterations=iterations),
+                          gate=gate, calibration=self.calibration, variance=self.get_variance())
+
+    def changed(self):
+        # the spectrum was changed in place, the cached results are not valid anymore
+        self.backgrounds.clear()
+        self.version += 1
+
+    def get_variance(self, slicing=None):
+        variance = np.maximum(self.spectrum, 0) if self.variance is None else self.variance
+        if not slicing:
+            return variance
+        return variance[slice(*slicing)]
+
+    def get_sigma(self, slicing=None):
+        # the empty bins get the error of one count
+        return np.sqrt(np.maximum(self.get_variance(slicing), 1))
 
     def get_spectrum(self, slicing=None):
+        if self.calibration is not None:
+            data_x = self.calibration.axis(len(self.spectrum))
+            if not slicing:
+                return data_x, self.spectrum
+            return data_x[slice(*slicing)], self.spectrum[slice(*slicing)]
+
         if not slicing:
             return np.arange(0, len(self.spectrum)), self.spectrum
         else:
             return np.arange(*slicing), self.spectrum[slice(*slicing)]
 
+    def energy_to_bin(self, energies):
+        if self.calibration is None:
+            return np.asarray(energies, dtype=float)
+        return self.calibration.energy_to_bin(energies, len(self.spectrum))
+
     def __repr__(self):
         return 'DataSet({}, {})'.format(self.gate.read_gate_name(), self.gate.type)
 
@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+# Headless export of zoomed figures (no display and no Window needed).
+#
+# Every x window (given directly or as the energies of the 'Show energy' box)
+# is rendered with the Agg backend for the same set of spectra, the windows
+# are split between the worker processes.
+#
+# usage: python3 -m spectview.export gate_g1436g444.txt bg_g1436g444.txt \
+#            -w 400-600 1000-1200 -e 583 911 -f svg png -j 4
+import os
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from spectview.datatypes import DataSet
+from spectview.range_max import RangeMaxIndex
+import spectview.settings as settings
+
+
+def energy_windows(energies, width=None):
+    d = (width or settings.SHOW_PEAK_WINDOW_WIDTH) / 2
+    return [(energy - d, energy + d) for energy in energies]
+
+
+def create_figure(datasets):
+    figure = Figure(figsize=settings.FIGURE_SIZE)
+    FigureCanvasAgg(figure)
+    figure.subplots_adjust(**settings.WINDOW_SETUP)
+    ax = figure.add_subplot(111)
+    ax.tick_params(axis='both', labelsize=settings.LABELS_SIZE)
+    ax.set_ylabel('Number of counts', fontsize=settings.LABELS_SIZE)
+
+    plot_setup = {k: v for k, v in settings.SPECTRUM_PLOT_SETUP.items() if k != 'picker'}
+    lines = [
+        ax.plot(*dataset.get_spectrum(), label=dataset.gate.__repr__(), **plot_setup)[0]
+        for dataset in datasets
+    ]
+    if len(datasets) > 1:
+        ax.legend(loc='upper right', fontsize=settings.BUTTONS_FONTSIZE)
+    else:
+        figure.text(s=datasets[0].gate.__repr__(), color=lines[0].get_color(), **settings.GATE_NAME_BOX_SETUP)
+    return figure, ax, lines
+
+
+def render_windows(job):
+    # one worker renders its windows reusing one figure
+    files, windows, formats, output_path = job
+    datasets = [DataSet.from_file(file) for file in files]
+    figure, ax, lines = create_figure(datasets)
+    gate_name = '+'.join(dataset.gate.__repr__() for dataset in datasets)
+    range_maxima = [RangeMaxIndex(*dataset.get_spectrum()) for dataset in datasets]
+
+    saved = []
+    for x1, x2 in windows:
+        ax.set_xlim(x1, x2)
+        y_max = 0
+        for line2d, range_max in zip(lines, range_maxima):
+            # only the visible part of the spectrum (plus one bin) is rendered
+            start = max(0, range_max.data_x.searchsorted(x1) - 1)
+            stop = range_max.data_x.searchsorted(x2, side='right') + 1
+            line2d.set_data(range_max.data_x[start:stop], range_max.data_y[start:stop])
+            try:
+                y_max = max(y_max, range_max.max_in_range(x1, x2))
+            except ValueError:
+                # the window is out of this spectrum
+                pass
+        ax.set_ylim(0, 1.2 * y_max or 1)
+
+        for file_format in formats:
+            file_name = os.path.join(output_path, f'{gate_name}_{int(x1)}-{int(x2)}.{file_format}')
+            figure.savefig(file_name)
+            saved.append(file_name)
+    return saved
+
+
+def export_regions(files, windows, formats=('svg',), output_path=None, max_workers=None):
+    output_path = output_path or settings.OUTPUT_FIGURES_PATH
+    if not os.path.exists(output_path):
+        os.makedirs(output_path)
+
+    max_workers = max_workers or os.cpu_count() or 1
+    chunks = [windows[i::max_workers] for i in range(max_workers) if windows[i::max_workers]]
+    jobs = [(files, chunk, formats, output_path) for chunk in chunks]
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return [file_name for saved in executor.map(render_windows, jobs) for file_name in saved]
+
+
+def parse_window(text):
+    x1, x2 = text.split('-')
+    return float(x1), float(x2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Save zoomed figures of the spectra.')
+    parser.add_argument('files', nargs='+', help='spectra drawn in every figure')
+    parser.add_argument('-w', '--windows', nargs='*', type=parse_window, default=[],
+                        help='x ranges, e.g. 400-600')
+    parser.add_argument('-e', '--energies', nargs='*', type=float, default=[],
+                        help='energies shown in the SHOW_PEAK_WINDOW_WIDTH window')
+    parser.add_argument('-f', '--formats', nargs='*', default=['svg'], help='e.g. svg png pdf')
+    parser.add_argument('-o', '--output', help='output directory')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of worker processes')
+    args = parser.parse_args(argv)
+
+    windows = args.windows + energy_windows(args.energies)
+    if not windows:
+        parser.error('no windows nor energies given')
+
+    saved = export_regions(args.files, windows, formats=args.formats,
+                           output_path=args.output, max_workers=args.jobs)
+    print(f'{len(saved)} files saved.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
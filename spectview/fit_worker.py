@@ -0,0 +1,118 @@
+import multiprocessing
+import queue
+import threading
+
+
+class FitJob:
+
+    def __init__(self, peak_fit, name, gate_name):
+        self.peak_fit = peak_fit
+        # name of the plotted fit curve and of the fitted spectrum
+        self.name = name
+        self.gate_name = gate_name
+        self.iteration = 0
+        self.error = None
+        self.cancel_event = threading.Event()
+
+    @property
+    def is_cancelled(self):
+        return self.cancel_event.is_set()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def iter_cb(self, params, iteration, resid, *args, **kws):
+        # called by lmfit after every function evaluation, True stops the fit
+        self.iteration = iteration
+        return self.is_cancelled
+
+    @property
+    def status(self):
+        return f'{self.iteration} evaluations'
+
+    def run(self, verbosity=False):
+        self.peak_fit.do_fit(verbosity=verbosity, iter_cb=self.iter_cb)
+
+
+class BootstrapJob(FitJob):
+    # bootstrap intervals of a finished fit; the worker processes are started by
+    # a forkserver (or spawned), they aren't forked from the threads of the GUI
+
+    def __init__(self, peak_fit, name, gate_name, n_samples=None):
+        super().__init__(peak_fit, name, gate_name)
+        self.n_samples = n_samples
+        self.bootstrap_result = None
+
+    def progress_cb(self, n_done):
+        # called after every chunk of the resampled fits, True stops the bootstrap
+        self.iteration = n_done
+        return self.is_cancelled
+
+    @property
+    def status(self):
+        return f'{self.iteration} resampled fits'
+
+    def run(self, verbosity=False):
+        from spectview.bootstrap import bootstrap
+
+        start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        self.bootstrap_result = bootstrap(
+            self.peak_fit, n_samples=self.n_samples,
+            mp_context=multiprocessing.get_context(start_method), progress_cb=self.progress_cb
+        )
+
+
+class FitWorker:
+    # fits (and bootstraps) run one by one in a background thread, so the GUI is not blocked;
+    # the finished jobs are collected by the GUI thread with get_finished()
+
+    def __init__(self, verbosity=False):
+        self.verbosity = verbosity
+        self._pending = queue.Queue()
+        self._finished = queue.Queue()
+        self._jobs = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, job):
+        with self._lock:
+            self._jobs.append(job)
+            if self._thread is None:
+                # the thread waits for the next jobs until the program ends
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        self._pending.put(job)
+        return job
+
+    def _run(self):
+        while True:
+            job = self._pending.get()
+            if not job.is_cancelled:
+                try:
+                    job.run(verbosity=self.verbosity)
+                except Exception as error:
+                    # reported to the GUI thread with the job
+                    job.error = error
+            self._finished.put(job)
+
+    def get_finished(self):
+        finished = []
+        while True:
+            try:
+                job = self._finished.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._jobs.remove(job)
+            finished.append(job)
+        return finished
+
+    @property
+    def jobs(self):
+        # queued and running jobs
+        with self._lock:
+            return list(self._jobs)
+
+    def cancel_all(self):
+        for job in self.jobs:
+            job.cancel()
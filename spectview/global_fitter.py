@@ -0,0 +1,227 @@
+from types import SimpleNamespace
+
+import numpy as np
+from numpy import arange
+from scipy.optimize import leastsq
+
+from spectview.peak_fitter import SQRT_2PI, TINY
+
+
+class FitAborted(Exception):
+    pass
+
+
+class GlobalPeakFitter:
+    # one region of N spectra (e.g. the gate and bg spectra of the same transition)
+    # fitted at once: the centroids and widths of the peaks are shared, the amplitudes
+    # and the linear (or fixed) backgrounds belong to every spectrum.
+    # The amplitudes and backgrounds enter the model linearly, so they are solved
+    # spectrum by spectrum for every shared centroids and widths (variable projection)
+    # and only the 2*peaks shared parameters are iterated: one evaluation, the
+    # jacobian and the errors cost N times the cost of one spectrum
+    ith_fit = 0
+
+    def __init__(self, spectra, peaks, backgrounds=None, sigmas=None, names=None):
+        # spectra: (data_x, data_y) of every spectrum, backgrounds and sigmas: arrays
+        # at data_x (or None) for every spectrum
+        GlobalPeakFitter.ith_fit += 1
+        self.number = GlobalPeakFitter.ith_fit
+        self.spectra = [(np.asarray(x, dtype=float), np.asarray(y, dtype=float)) for x, y in spectra]
+        self.peaks = peaks
+        self.backgrounds = backgrounds or [None] * len(self.spectra)
+        self.sigmas = sigmas or [None] * len(self.spectra)
+        self.names = names or [f'spectrum_{j}' for j in range(len(self.spectra))]
+        if not len(self.backgrounds) == len(self.sigmas) == len(self.names) == len(self.spectra):
+            raise ValueError('One background, sigma and name is needed for every spectrum.')
+        if not self.spectra or not self.peaks:
+            raise ValueError('No spectra or peaks for the global fit.')
+        self.bin_widths = [float(np.median(np.diff(x))) if len(x) > 1 else 1.0 for x, _ in self.spectra]
+
+        # initial centroids and widths (the widths as in the PeakFitter)
+        self.shared = np.array(
+            [peak.centroid for peak in peaks] + [self.bin_widths[0]] * len(peaks), dtype=float
+        )
+        self.result = None
+        self.spectrum_fits = []
+        # the jacobian is evaluated at the point of the last residual
+        self._last_solutions = (None, None)
+
+    @property
+    def n_peaks(self):
+        return len(self.peaks)
+
+    def _weights(self, j):
+        sigma = self.sigmas[j]
+        return 1.0 if sigma is None else 1.0 / np.maximum(np.asarray(sigma, dtype=float), TINY)
+
+    def _design(self, j, shared, data_x=None):
+        # columns of the model linear in the amplitudes (and the linear background)
+        # and the derivatives of the peak shapes over the centroids and widths
+        data_x = self.spectra[j][0] if data_x is None else data_x
+        cen = shared[:self.n_peaks, None]
+        wid = np.maximum(shared[self.n_peaks:], TINY)[:, None]
+        u = (data_x - cen) / wid
+        shape = np.exp(-0.5 * u**2) / (SQRT_2PI * wid)
+        # over the fixed background (SNIP, below the continuum) only the offset is free
+        columns = [shape]
+        if self.backgrounds[j] is None:
+            columns.append(data_x[None, :])
+        columns.append(np.ones((1, len(data_x))))
+        design = np.concatenate(columns).T
+        return design, shape * u / wid, shape * (u**2 - 1) / wid
+
+    def _solve_spectrum(self, j, shared):
+        # best linear parameters of the spectrum j for the shared ones; the weighted
+        # design, its QR decomposition, the residual and the derivative of the model
+        # over the shared parameters at the linear solution
+        data_x, data_y = self.spectra[j]
+        weights = self._weights(j)
+        target = data_y if self.backgrounds[j] is None else data_y - self.backgrounds[j]
+        design, d_cen, d_wid = self._design(j, shared)
+        design = design * np.reshape(weights, (-1, 1))
+        q, r = np.linalg.qr(design)
+        linear = np.linalg.lstsq(r, q.T @ (target * weights), rcond=None)[0]
+        residual = design @ linear - target * weights
+        amp = linear[:self.n_peaks, None]
+        d_shared = np.concatenate((amp * d_cen, amp * d_wid)) * weights
+        return linear, q, r, residual, d_shared
+
+    def _solve(self, shared):
+        key = shared.tobytes()
+        if self._last_solutions[0] != key:
+            self._last_solutions = (key, [self._solve_spectrum(j, shared) for j in range(len(self.spectra))])
+        return self._last_solutions[1]
+
+    def residual(self, shared):
+        return np.concatenate([solution[3] for solution in self._solve(shared)])
+
+    def jacobian(self, shared):
+        # rows are the shared parameters (col_deriv=True), the blocks of the spectra
+        # are their derivatives projected out of the space of the linear parameters
+        return np.concatenate(
+            [d_shared - (d_shared @ q) @ q.T for _, q, _, _, d_shared in self._solve(shared)], axis=1
+        )
+
+    def do_fit(self, verbosity=False, iter_cb=None):
+        # iter_cb(shared, iteration, residual) is called after every evaluation as in lmfit,
+        # True stops the fit (leastsq has no callback, so it is stopped by an exception)
+        n_evaluations = [0]
+
+        def residual(shared):
+            output = self.residual(shared)
+            n_evaluations[0] += 1
+            if iter_cb is not None and iter_cb(shared, n_evaluations[0], output):
+                raise FitAborted()
+            return output
+
+        try:
+            shared, _, info, message, ier = leastsq(
+                residual, self.shared, Dfun=self.jacobian, col_deriv=True, full_output=True
+            )
+        except FitAborted:
+            self.result = SimpleNamespace(aborted=True, nfev=n_evaluations[0])
+            return
+        solutions = self._solve(shared)
+        residual = np.concatenate([solution[3] for solution in solutions])
+        n_varys = len(shared) + sum(len(solution[0]) for solution in solutions)
+        chisqr = float(residual @ residual)
+        nfree = max(len(residual) - n_varys, 1)
+        self.result = SimpleNamespace(
+            shared=shared, linear=[solution[0] for solution in solutions],
+            chisqr=chisqr, redchi=chisqr / nfree, nfev=int(info['nfev']), nvarys=n_varys,
+            ndata=len(residual), success=ier in (1, 2, 3, 4), message=message, aborted=False
+        )
+        self._calculate_errors(solutions)
+        self.spectrum_fits = [SpectrumFit(self, j) for j in range(len(self.spectra))]
+
+        if verbosity:
+            print(self.generate_fit_report())
+
+    def _calculate_errors(self, solutions):
+        # covariance of all the parameters from the arrowhead normal matrix
+        # (shared block, one diagonal block per spectrum) by the Schur complement,
+        # scaled by the reduced chi-square as in the PeakFitter
+        self.result.shared_err = None
+        self.result.linear_err = [None] * len(solutions)
+        blocks = []
+        for _, q, r, _, d_shared in solutions:
+            projected = d_shared - (d_shared @ q) @ q.T
+            blocks.append((r, q.T @ d_shared.T, projected))
+        schur = sum(projected @ projected.T for _, _, projected in blocks)
+        try:
+            shared_covar = np.linalg.inv(schur) * self.result.redchi
+            linear_err = []
+            for r, coupling, _ in blocks:
+                r_inv = np.linalg.inv(r)
+                # D^-1 + C S^-1 C^T with D = R^T R and C = R^-1 Q^T dA/dshared
+                c = r_inv @ coupling
+                linear_covar = r_inv @ r_inv.T * self.result.redchi + c @ shared_covar @ c.T
+                linear_err.append(np.sqrt(np.diag(linear_covar)))
+        except np.linalg.LinAlgError:
+            return
+        self.result.shared_err = np.sqrt(np.diag(shared_covar))
+        self.result.linear_err = linear_err
+
+    def model(self, j, data_x):
+        design, _, _ = self._design(j, self.result.shared, data_x)
+        model = design @ self.result.linear[j]
+        if self.backgrounds[j] is not None:
+            model = model + np.interp(data_x, self.spectra[j][0], self.backgrounds[j])
+        return model
+
+    def get_peaks_parameters(self):
+        # parameters of every peak of every spectrum (list per spectrum), as in the PeakFitter
+        return [spectrum_fit.get_peaks_parameters() for spectrum_fit in self.spectrum_fits]
+
+    def generate_fit_report(self):
+        report = (
+            f'\n\n{"="*10}\nGLOBAL FIT REPORT\n{"="*10}\n\n'
+            f'spectra: {len(self.spectra)}, data points: {self.result.ndata}, '
+            f'variables: {self.result.nvarys}, function evals: {self.result.nfev}\n'
+            f'chi-square: {self.result.chisqr:.6g}, reduced chi-square: {self.result.redchi:.6g}\n'
+        )
+        for name, peaks in zip(self.names, self.get_peaks_parameters()):
+            report += f'[[{name}]]\n' + ''.join(
+                f'    peak_{i}: cen = {peak["centroid"]:.4f} +/- {peak["centroid_err"] or 0:.4f}, '
+                f'wid = {peak["sigma"]:.4f} +/- {peak["sigma_err"] or 0:.4f}, '
+                f'area = {peak["area"]:.1f} +/- {peak["area_err"] or 0:.1f}\n'
+                for i, peak in enumerate(peaks)
+            )
+        return report
+
+
+class SpectrumFit:
+    # one spectrum of the global fit, with the interface of the PeakFitter
+    # used by the plotting and the results (fit_rows)
+
+    def __init__(self, global_fit, j):
+        self.global_fit = global_fit
+        self.j = j
+        self.name = global_fit.names[j]
+        self.data_x, self.data_y = global_fit.spectra[j]
+        self.bin_width = global_fit.bin_widths[j]
+        self.result = global_fit.result
+
+    def get_result(self):
+        x = arange(self.data_x[0], self.data_x[-1], 0.1 * self.bin_width)
+        return x, self.global_fit.model(self.j, x)
+
+    def generate_fit_report(self):
+        return self.global_fit.generate_fit_report()
+
+    def get_peaks_parameters(self):
+        result = self.global_fit.result
+        n_peaks = self.global_fit.n_peaks
+        output = []
+        for i in range(n_peaks):
+            shared_err = [None, None] if result.shared_err is None else result.shared_err[[i, n_peaks + i]]
+            area_err = None if result.linear_err[self.j] is None else result.linear_err[self.j][i]
+            output.append({
+                'centroid': float(result.shared[i]),
+                'centroid_err': None if shared_err[0] is None else float(shared_err[0]),
+                'area': float(result.linear[self.j][i]) / self.bin_width,
+                'area_err': None if area_err is None else float(area_err) / self.bin_width,
+                'sigma': float(result.shared[n_peaks + i]),
+                'sigma_err': None if shared_err[1] is None else float(shared_err[1])
+            })
+        return output
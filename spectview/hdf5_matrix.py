@@ -0,0 +1,127 @@
+import math
+
+import numpy as np
+
+import spectview.settings as settings
+
+
+def window_to_slice(window, size):
+    # bins which centres lie inside the [low, high] gate window
+    if window is None:
+        return slice(0, size)
+    low, high = sorted(window)
+    # windows (partly) outside of the matrix are clamped to [0, size]
+    start = min(size, max(0, math.ceil(low)))
+    stop = min(size, max(0, math.floor(high) + 1))
+    return slice(start, stop)
+
+
+class HDF5Matrix:
+    # gamma-gamma matrix (y, x) or gamma-gamma-gamma cube (z, y, x) kept on disk,
+    # the gated spectra are projected on the x axis reading only the gated slab
+
+    def __init__(self, file, dataset_name=None):
+        # h5py is optional and slow to import, it is loaded with the first .h5 file
+        try:
+            import h5py
+        except ImportError:
+            raise ImportError('The h5py package is needed to read the .h5 files.')
+
+        self.file = file
+        self._h5file = h5py.File(file, 'r')
+        self.data = self._find_dataset(dataset_name or settings.HDF5_DATASET_NAME)
+
+    def _find_dataset(self, dataset_name):
+        if dataset_name:
+            return self._h5file[dataset_name]
+
+        found = []
+
+        def visit(name, item):
+            if hasattr(item, 'ndim') and item.ndim in (2, 3):
+                found.append(item)
+
+        self._h5file.visititems(visit)
+        if not found:
+            raise ValueError(f'There is no matrix or cube in the {self.file} file.')
+        return found[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._h5file.close()
+
+    @property
+    def ndim(self):
+        return self.data.ndim
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def accumulator_dtype(self):
+        if np.issubdtype(self.data.dtype, np.integer):
+            return np.int64
+        return np.float64
+
+    def gate_slices(self, gate_z=None, gate_y=None):
+        if self.ndim == 2:
+            if gate_z is not None:
+                print('The gate on z is ignored for a gamma-gamma matrix.')
+            return (window_to_slice(gate_y, self.shape[0]),)
+        return (window_to_slice(gate_z, self.shape[0]),
+                window_to_slice(gate_y, self.shape[1]))
+
+    def iter_blocks(self, gate_slices):
+        # split the gated slab along its first axis into blocks aligned
+        # with the HDF5 chunks (if any) and not bigger than the read limit
+        first, *rest = gate_slices
+        row_size = int(np.prod([s.stop - s.start for s in rest] + [self.shape[-1]]))
+        step = max(1, settings.HDF5_READ_BLOCK_SIZE // max(1, row_size))
+        if self.data.chunks:
+            chunk_rows = self.data.chunks[0]
+            step = max(chunk_rows, step - step % chunk_rows)
+            start = first.start - first.start % chunk_rows
+        else:
+            start = first.start
+
+        for block_start in range(start, first.stop, step):
+            block_slice = slice(max(block_start, first.start), min(block_start + step, first.stop))
+            yield (block_slice, *rest, slice(None))
+
+    def sum_planes(self, z_slice):
+        # (y, x) matrix of a cube summed over the z gate
+        plane = np.zeros(self.shape[1:], dtype=self.accumulator_dtype)
+        if z_slice.start >= z_slice.stop:
+            return plane
+
+        for block in self.iter_blocks((z_slice, slice(0, self.shape[1]))):
+            plane += self.data[block].sum(axis=0, dtype=self.accumulator_dtype)
+        return plane
+
+    def y_prefix_sums(self):
+        # running sums over the y axis of a matrix, prefix[j] = sum of rows < j
+        prefix = np.zeros((self.shape[0] + 1, self.shape[1]), dtype=self.accumulator_dtype)
+        for block in self.iter_blocks((slice(0, self.shape[0]),)):
+            rows = block[0]
+            prefix[rows.start + 1: rows.stop + 1] = (
+                np.cumsum(self.data[block], axis=0, dtype=self.accumulator_dtype) + prefix[rows.start]
+            )
+        return prefix
+
+    def project(self, gate_z=None, gate_y=None):
+        gate_slices = self.gate_slices(gate_z=gate_z, gate_y=gate_y)
+        spectrum = np.zeros(self.shape[-1], dtype=self.accumulator_dtype)
+        summed_axes = tuple(range(self.ndim - 1))
+        if any(s.start >= s.stop for s in gate_slices):
+            print('The gate window is out of the matrix range.')
+            return spectrum
+
+        for block in self.iter_blocks(gate_slices):
+            spectrum += self.data[block].sum(axis=summed_axes, dtype=self.accumulator_dtype)
+        return spectrum
@@ -0,0 +1,83 @@
+import json
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class ActionTimer:
+    # wall time of the user actions split into the handler and the drawing part,
+    # the last `window_size` calls of every action are kept
+
+    def __init__(self, window_size=100):
+        self.window_size = window_size
+        self.records = defaultdict(lambda: deque(maxlen=self.window_size))
+        self._current = None
+
+    @contextmanager
+    def action(self, name):
+        if self._current is not None:
+            # an action called by another action is a part of it
+            yield
+            return
+
+        self._current = {'draw': 0.0, 'nfev': None}
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record, self._current = self._current, None
+            record['total'] = time.perf_counter() - start
+            record['handler'] = record['total'] - record['draw']
+            self.records[name].append(record)
+
+    @contextmanager
+    def draw(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self._current is not None:
+                self._current['draw'] += time.perf_counter() - start
+
+    def record_fit(self, nfev):
+        if self._current is not None:
+            self._current['nfev'] = nfev
+
+    def statistics(self):
+        output = {}
+        for name, records in self.records.items():
+            action_statistics = {'count': len(records)}
+            for phase in ('total', 'handler', 'draw'):
+                times = np.array([record[phase] for record in records])
+                action_statistics[phase] = {
+                    'mean': times.mean(), 'median': np.median(times), 'max': times.max()
+                }
+            nfev = [record['nfev'] for record in records if record['nfev'] is not None]
+            if nfev:
+                action_statistics['nfev'] = {'mean': float(np.mean(nfev)), 'max': max(nfev)}
+            output[name] = action_statistics
+        return output
+
+    def report(self):
+        lines = [
+            f'{"action":<26} {"calls":>6} {"total [ms]":>11} {"handler [ms]":>13} '
+            f'{"draw [ms]":>10} {"max [ms]":>9} {"nfev":>6}'
+        ]
+        statistics = sorted(self.statistics().items(), key=lambda item: -item[1]['total']['mean'])
+        for name, action_statistics in statistics:
+            nfev = action_statistics.get('nfev', {}).get('mean')
+            lines.append(
+                f'{name:<26} {action_statistics["count"]:>6} '
+                f'{1e3 * action_statistics["total"]["mean"]:>11.1f} '
+                f'{1e3 * action_statistics["handler"]["mean"]:>13.1f} '
+                f'{1e3 * action_statistics["draw"]["mean"]:>10.1f} '
+                f'{1e3 * action_statistics["total"]["max"]:>9.1f} '
+                + (f'{nfev:>6.0f}' if nfev is not None else f'{"-":>6}')
+            )
+        return '\n'.join(lines)
+
+    def dump(self, file):
+        with open(file, 'w') as f:
+            json.dump(self.statistics(), f, indent=2, default=float)
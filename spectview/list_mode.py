@@ -0,0 +1,312 @@
+#!/usr/bin/python3
+# List mode (event by event) files: fixed size binary records of the
+# settings.LIST_MODE_RECORD type appended by the DAQ during the run.
+#
+# Whole files are histogrammed in chunks of records by the worker processes,
+# every worker reads its part of the memory mapped file; gamma-gamma matrices
+# are built from the records closer in time than COINCIDENCE_WINDOW
+# (the records are expected in the time order).
+#
+# usage: python3 -m spectview.list_mode generate run.bin --rate 20000
+#        python3 -m spectview.list_mode watch run.bin
+#        python3 -m spectview.list_mode histogram run.bin -o run.txt --energy 50 4000
+#        python3 -m spectview.list_mode matrix run.bin -o run_gg.h5 -j 8
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from spectview.calibration import Calibration
+from spectview.datatypes import DataSet, GateInfo
+import spectview.settings as settings
+
+
+def record_dtype():
+    return np.dtype(settings.LIST_MODE_RECORD)
+
+
+class ListModeTail:
+    # reads the records appended to the file since the last call,
+    # a record which is not written completely yet is left for the next call
+
+    def __init__(self, file, dtype=None):
+        self.file = file
+        self.dtype = dtype or record_dtype()
+        self.offset = 0
+
+    def read_new(self, max_records=None):
+        try:
+            size = os.path.getsize(self.file)
+        except OSError:
+            # the DAQ has not created the file yet
+            return np.empty(0, dtype=self.dtype)
+
+        n_records = (size - self.offset) // self.dtype.itemsize
+        if max_records is not None:
+            n_records = min(n_records, max_records)
+        if n_records <= 0:
+            return np.empty(0, dtype=self.dtype)
+
+        with open(self.file, 'rb') as f:
+            f.seek(self.offset)
+            events = np.fromfile(f, dtype=self.dtype, count=n_records)
+        self.offset += len(events) * self.dtype.itemsize
+        return events
+
+
+class LiveSpectrum:
+    # spectrum of a growing list mode file, only the new events are histogrammed
+
+    def __init__(self, file, n_bins=None, energy_field=None):
+        self.n_bins = n_bins or settings.SPECTRUM_BINS
+        self.energy_field = energy_field or settings.LIST_MODE_ENERGY_FIELD
+        self.tail = ListModeTail(file)
+        self.n_events = 0
+
+        gate = GateInfo(filename=f'live_{os.path.splitext(os.path.basename(file))[0]}.bin')
+        gate.source_file = os.path.basename(file)
+        self.dataset = DataSet(
+            spectrum=np.zeros(self.n_bins, dtype=np.int64), gate=gate,
+            calibration=Calibration.for_spectrum(file)
+        )
+
+    def update(self):
+        # number of the new events
+        n_new = 0
+        while True:
+            events = self.tail.read_new(max_records=settings.LIST_MODE_CHUNK_SIZE)
+            if not len(events):
+                break
+            channels = events[self.energy_field].astype(np.intp, copy=False)
+            channels = channels[(channels >= 0) & (channels < self.n_bins)]
+            self.dataset.spectrum += np.bincount(channels, minlength=self.n_bins)
+            n_new += len(events)
+        if n_new:
+            # e.g. the backgrounds of the old spectrum
+            self.dataset.changed()
+        self.n_events += n_new
+        return n_new
+
+
+def open_events(file, dtype=None):
+    # the records are read from the disk only when they are used
+    dtype = dtype or record_dtype()
+    n_records = os.path.getsize(file) // dtype.itemsize
+    if not n_records:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(file, dtype=dtype, mode='r', shape=(n_records,))
+
+
+def chunk_bounds(n_records, chunk_size=None):
+    chunk_size = chunk_size or settings.LIST_MODE_CHUNK_SIZE
+    return [(start, min(start + chunk_size, n_records)) for start in range(0, n_records, chunk_size)]
+
+
+def _channels(events, n_bins, energy_cut=None, time_cut=None):
+    # energy channels of the events and the mask of the events passing the cuts
+    channels = events[settings.LIST_MODE_ENERGY_FIELD].astype(np.intp)
+    mask = (channels >= 0) & (channels < n_bins)
+    if energy_cut is not None:
+        mask &= (channels >= energy_cut[0]) & (channels <= energy_cut[1])
+    if time_cut is not None:
+        times = events['time']
+        mask &= (times >= time_cut[0]) & (times <= time_cut[1])
+    return channels, mask
+
+
+def _histogram_chunk(job):
+    file, start, stop, n_bins, energy_cut, time_cut = job
+    events = open_events(file)[start:stop]
+    channels, mask = _channels(events, n_bins, energy_cut, time_cut)
+    return np.bincount(channels[mask], minlength=n_bins)
+
+
+def _matrix_chunk(job):
+    # pairs (i, i + lag) of the records of the chunk with their later neighbours,
+    # the partners can lie up to COINCIDENCE_MAX_LAG records after the chunk;
+    # the matrix of a chunk is sparse: (flat indices, counts) of its filled elements
+    file, start, stop, n_bins, energy_cut, time_cut = job
+    all_events = open_events(file)
+    events = all_events[start:min(stop + settings.COINCIDENCE_MAX_LAG, len(all_events))]
+    channels, mask = _channels(events, n_bins, energy_cut, time_cut)
+    times = events['time'].astype(np.int64)
+    detectors = events['detector'] if 'detector' in events.dtype.names else None
+
+    first = np.arange(stop - start)
+    flat_indices = []
+    for lag in range(1, settings.COINCIDENCE_MAX_LAG + 1):
+        i = first[first + lag < len(events)]
+        j = i + lag
+        in_window = times[j] - times[i] <= settings.COINCIDENCE_WINDOW
+        if not in_window.any():
+            # the records are in the time order, so the further ones are not in the window either
+            break
+        is_pair = in_window & mask[i] & mask[j]
+        if detectors is not None:
+            is_pair &= detectors[i] != detectors[j]
+        e1, e2 = channels[i[is_pair]], channels[j[is_pair]]
+        flat_indices += [e1 * n_bins + e2, e2 * n_bins + e1]
+
+    flat_indices = np.concatenate(flat_indices) if flat_indices else np.empty(0, dtype=np.intp)
+    return np.unique(flat_indices, return_counts=True)
+
+
+def _energy_cut_in_channels(energy_cut, calibration, n_bins):
+    # the cut is given in the x units of the spectrum (keV for the calibrated ones)
+    if energy_cut is None or calibration is None:
+        return energy_cut
+    return tuple(calibration.energy_to_bin(energy_cut, n_bins))
+
+
+def _add_part(total, part):
+    # dense histogram of a chunk or the sparse one (unique flat indices, counts)
+    if isinstance(part, tuple):
+        indices, counts = part
+        total.reshape(-1)[indices] += counts
+    else:
+        total += part
+
+
+def _reduce_chunks(function, shape, file, energy_cut, time_cut, max_workers, chunk_size):
+    # sum of the histograms of the chunks, made one by one when there is one chunk or worker
+    jobs = [
+        (file, start, stop, shape[0], energy_cut, time_cut)
+        for start, stop in chunk_bounds(len(open_events(file)), chunk_size)
+    ]
+    total = np.zeros(shape, dtype=np.int64)
+    if max_workers == 1 or len(jobs) <= 1:
+        for part in map(function, jobs):
+            _add_part(total, part)
+        return total
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for part in executor.map(function, jobs):
+            _add_part(total, part)
+    return total
+
+
+def histogram_file(file, n_bins=None, energy_cut=None, time_cut=None, max_workers=None, chunk_size=None):
+    # spectrum of the whole list mode file
+    n_bins = n_bins or settings.SPECTRUM_BINS
+    calibration = Calibration.for_spectrum(file)
+    energy_cut = _energy_cut_in_channels(energy_cut, calibration, n_bins)
+    spectrum = _reduce_chunks(_histogram_chunk, (n_bins,), file, energy_cut, time_cut, max_workers, chunk_size)
+
+    gate = GateInfo(filename=f'projection_{os.path.splitext(os.path.basename(file))[0]}.bin')
+    gate.source_file = os.path.basename(file)
+    return DataSet(spectrum=spectrum, gate=gate, calibration=calibration)
+
+
+def histogram_matrix(file, n_bins=None, energy_cut=None, time_cut=None, max_workers=None, chunk_size=None):
+    # symmetric gamma-gamma matrix (y, x), e.g. for the projection.Projector
+    n_bins = n_bins or settings.MATRIX_BINS
+    energy_cut = _energy_cut_in_channels(energy_cut, Calibration.for_spectrum(file), n_bins)
+    return _reduce_chunks(_matrix_chunk, (n_bins, n_bins), file, energy_cut, time_cut, max_workers, chunk_size)
+
+
+def save_matrix(matrix, file):
+    if file.endswith('.h5'):
+        # h5py is an optional dependency, as in the hdf5_matrix
+        try:
+            import h5py
+        except ImportError:
+            raise ImportError('h5py is needed to save the matrices in the .h5 files.')
+        with h5py.File(file, 'w') as f:
+            f.create_dataset('matrix', data=matrix, compression='gzip', chunks=True)
+    else:
+        np.save(file, matrix)
+
+
+def synthetic_events(n_events, n_bins, start_time, random_state):
+    # exponential background with a few gaussian lines
+    dtype = record_dtype()
+    lines = np.array([0.15, 0.3, 0.55, 0.6]) * n_bins
+    is_line = random_state.uniform(size=n_events) < 0.3
+    energy = np.where(
+        is_line,
+        random_state.normal(random_state.choice(lines, n_events), 2.0),
+        random_state.exponential(n_bins / 5, n_events)
+    )
+
+    events = np.zeros(n_events, dtype=dtype)
+    events['time'] = start_time + np.sort(random_state.randint(0, 10**8, n_events))
+    events['detector'] = random_state.randint(0, 16, n_events)
+    events[settings.LIST_MODE_ENERGY_FIELD] = np.clip(energy, 0, n_bins - 1)
+    return events
+
+
+def generate(file, rate, duration, n_bins=None, interval=0.1, seed=0):
+    # a stand in for the DAQ: appends `rate` events per second to the file
+    n_bins = n_bins or settings.SPECTRUM_BINS
+    random_state = np.random.RandomState(seed)
+    n_events = max(1, int(rate * interval))
+    start = time.time()
+    with open(file, 'ab') as f:
+        while duration is None or time.time() - start < duration:
+            tick = time.time()
+            f.write(synthetic_events(n_events, n_bins, int(1e9 * tick), random_state).tobytes())
+            f.flush()
+            time.sleep(max(0.0, interval - (time.time() - tick)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='List mode files.')
+    subparsers = parser.add_subparsers(dest='command')
+
+    watch_parser = subparsers.add_parser('watch', help='show the spectrum growing with the file')
+    watch_parser.add_argument('file')
+    watch_parser.add_argument('-b', '--bins', type=int, default=None)
+
+    for command, help_text in (('histogram', 'sort the file into a spectrum'),
+                               ('matrix', 'sort the file into a gamma-gamma matrix')):
+        sort_parser = subparsers.add_parser(command, help=help_text)
+        sort_parser.add_argument('file')
+        sort_parser.add_argument('-o', '--output', required=True,
+                                 help='.txt spectrum or .h5/.npy matrix')
+        sort_parser.add_argument('-b', '--bins', type=int, default=None)
+        sort_parser.add_argument('--energy', nargs=2, type=float, default=None,
+                                 help='energy cut (keV for the calibrated files, channels otherwise)')
+        sort_parser.add_argument('--time', nargs=2, type=int, default=None, help='time cut')
+        sort_parser.add_argument('-j', '--jobs', type=int, default=None, help='number of worker processes')
+
+    generate_parser = subparsers.add_parser('generate', help='write a test list mode file')
+    generate_parser.add_argument('file')
+    generate_parser.add_argument('-r', '--rate', type=float, default=10000, help='events per second')
+    generate_parser.add_argument('-t', '--time', type=float, default=None, help='duration in seconds')
+    generate_parser.add_argument('-b', '--bins', type=int, default=None)
+
+    args = parser.parse_args(argv)
+    if args.command == 'watch':
+        import matplotlib.pyplot as plt
+        from spectview.window import Window
+
+        window = Window(show=False)
+        window.watch_list_mode(args.file, n_bins=args.bins)
+        plt.show()
+    elif args.command == 'histogram':
+        dataset = histogram_file(args.file, n_bins=args.bins, energy_cut=args.energy,
+                                 time_cut=args.time, max_workers=args.jobs)
+        np.savetxt(args.output, dataset.spectrum, fmt='%d',
+                   header=f'File {dataset.gate.source_file}, list mode,', comments='# ')
+        print(f'{dataset.spectrum.sum()} events saved to the {args.output} file.')
+    elif args.command == 'matrix':
+        matrix = histogram_matrix(args.file, n_bins=args.bins, energy_cut=args.energy,
+                                  time_cut=args.time, max_workers=args.jobs)
+        save_matrix(matrix, args.output)
+        print(f'{matrix.sum() // 2} coincidences saved to the {args.output} file.')
+    elif args.command == 'generate':
+        try:
+            generate(args.file, args.rate, args.time, n_bins=args.bins)
+        except KeyboardInterrupt:
+            pass
+    else:
+        parser.print_help()
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,49 @@
+import numpy as np
+
+
+class MinMaxPyramid:
+    # indices of the minimum and the maximum of every block of 2, 4, 8, ... bins,
+    # so a view of any x range can be drawn with a few points per pixel while
+    # every extremum (e.g. a peak top) is kept at its exact position and height
+
+    def __init__(self, data_x, data_y):
+        self.data_x = np.asarray(data_x)
+        self.data_y = np.asarray(data_y)
+        self.levels = self._build_levels()
+
+    def _build_levels(self):
+        # levels[k] = (argmin, argmax) for blocks of 2**(k+1) bins
+        levels = []
+        argmin = argmax = np.arange(len(self.data_y))
+        while len(argmin) > 1:
+            if len(argmin) % 2:
+                argmin = np.append(argmin, argmin[-1])
+                argmax = np.append(argmax, argmax[-1])
+            left_min, right_min = argmin[::2], argmin[1::2]
+            left_max, right_max = argmax[::2], argmax[1::2]
+            argmin = np.where(self.data_y[right_min] < self.data_y[left_min], right_min, left_min)
+            argmax = np.where(self.data_y[right_max] > self.data_y[left_max], right_max, left_max)
+            levels.append((argmin, argmax))
+        return levels
+
+    def __len__(self):
+        return len(self.data_y)
+
+    def get_view(self, x1, x2, max_points):
+        # one point outside of the view on each side keeps the line continuous
+        start = max(0, np.searchsorted(self.data_x, x1, side='left') - 1)
+        stop = min(len(self), np.searchsorted(self.data_x, x2, side='right') + 1)
+        n_points = stop - start
+
+        if n_points <= max_points or not self.levels:
+            return self.data_x[start:stop], self.data_y[start:stop]
+
+        # every block gives two points (its minimum and maximum)
+        level = min(len(self.levels), int(np.ceil(np.log2(2.0 * n_points / max_points))))
+        argmin, argmax = self.levels[level - 1]
+        first_block, last_block = start >> level, min(len(argmin), ((stop - 1) >> level) + 1)
+
+        indices = np.unique(np.concatenate(
+            ([start], argmin[first_block:last_block], argmax[first_block:last_block], [stop - 1])
+        ))
+        return self.data_x[indices], self.data_y[indices]
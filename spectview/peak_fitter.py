@@ -1,57 +1,132 @@
+from math import log, pi, sqrt
+
+import numpy as np
 from numpy import linspace, random, arange
 
+from scipy.optimize import leastsq
 from lmfit import Minimizer, Parameters
-from lmfit.lineshapes import gaussian, lorentzian
+from lmfit.lineshapes import lorentzian
 from lmfit.printfuncs import report_fit, fit_report
 
-
-class Peak:
-    def __init__(self, centroid, amp):
-        self.centroid = centroid
-        self.amp = amp
-
-    def __repr__(self):
-        return f'Peak(cen={self.centroid:.2f}, amp={self.amp:.2f})'
+SQRT_2PI = sqrt(2 * pi)
+FWHM_TO_SIGMA = 1 / (2 * sqrt(2 * log(2)))
+# the same lower limit of the gaussian width as in lmfit.lineshapes
+TINY = 1.0e-15
 
 
 class PeakFitter:
     ith_fit = 0
 
-    def __init__(self, data_x, data_y, peaks):
+    def __init__(self, data_x, data_y, peaks, background=None, fwhm_calibration=None, energies=None,
+                 free_width_scale=True, sigma=None):
+        # the number is known before the fit, which can run in the background
+        PeakFitter.ith_fit += 1
+        self.number = PeakFitter.ith_fit
         self.data_x = data_x
         self.data_y = data_y
+        # errors of data_y (e.g. of the derived spectra), the fit is not weighted without them
+        self.sigma = None if sigma is None else np.asarray(sigma, dtype=float)
         self.peaks = peaks
+        # fixed background (e.g. SNIP) at data_x in place of the fitted linear one
+        self.background = None if background is None else np.asarray(background, dtype=float)
+        # FWHM^2 = a + b*x + c*x^2: the widths follow the centroids (times a common scale)
+        self.fwhm_calibration = None if fwhm_calibration is None else [float(c) for c in fwhm_calibration]
+        self.free_width_scale = free_width_scale
+        # known energies of the peaks (None for the free ones): the centroids are the
+        # energies moved by one common shift
+        self.energies = list(energies) if energies is not None else [None] * len(peaks)
+        if len(self.energies) != len(self.peaks):
+            raise ValueError(f'{len(self.energies)} energies given for {len(self.peaks)} peaks.')
+        self._is_tied = np.array([energy is not None for energy in self.energies], dtype=bool)
+        self._tied_energies = np.array([energy or 0.0 for energy in self.energies], dtype=float)
         self.result = None
         self.init = None
         self.fit = None
+        # x units per bin (1 for the bin numbers, keV/bin for calibrated spectra)
+        self.bin_width = float(np.median(np.diff(data_x))) if len(data_x) > 1 else 1.0
 
         self.params = Parameters()
         self._initialize_params()
 
     def _initialize_params(self):
-        # initialize params for gaussian curves
+        # common parameters of the constrained centroids and widths
+        if self._is_tied.any():
+            shifts = [peak.centroid - energy for peak, energy in zip(self.peaks, self.energies) if energy is not None]
+            self.params.add(name='cen_shift', value=float(np.mean(shifts)))
+        if self.fwhm_calibration is not None:
+            self.params.add(name='wid_scale', value=1.0, vary=self.free_width_scale)
+
+        # initialize params for gaussian curves (only of the free centroids and widths)
         for i, peak in enumerate(self.peaks):
             self.params.add(name=f'amp_{i}', value=peak.amp)
-            self.params.add(name=f'cen_{i}', value=peak.centroid)
-            self.params.add(name=f'wid_{i}', value=1)
+            if not self._is_tied[i]:
+                self.params.add(name=f'cen_{i}', value=peak.centroid)
+            if self.fwhm_calibration is None:
+                self.params.add(name=f'wid_{i}', value=self.bin_width)
 
-        # initialize params for linear background
-        self.params.add(name='line_slope', value=0.0)
+        # initialize params for linear background; on top of the fixed one only the offset
+        # is free, SNIP lies systematically below the continuum
+        has_linear_background = self.background is None
+        self.params.add(name='line_slope', value=0.0, vary=has_linear_background)
         self.params.add(name='line_off', value=0.0)
 
+    @staticmethod
+    def _values(params):
+        # lmfit Parameters or a plain dict of the parameter values (used by refit)
+        return params.valuesdict() if isinstance(params, Parameters) else params
+
+    def _peak_arrays(self, params):
+        # amplitudes, centroids and widths of all peaks, also of the constrained ones
+        values = self._values(params)
+        peaks_range = range(len(self.peaks))
+        amp = np.array([values[f'amp_{i}'] for i in peaks_range], dtype=float)
+
+        if self._is_tied.any():
+            cen = self._tied_energies + values['cen_shift']
+        else:
+            cen = np.empty(len(self.peaks))
+        for i in np.flatnonzero(~self._is_tied):
+            cen[i] = values[f'cen_{i}']
+
+        if self.fwhm_calibration is None:
+            wid = np.array([values[f'wid_{i}'] for i in peaks_range], dtype=float)
+        else:
+            wid = values['wid_scale'] * self._sigma_calibration(cen)
+        return amp, cen, wid
+
+    def _sigma_calibration(self, cen):
+        a, b, c = self.fwhm_calibration
+        return FWHM_TO_SIGMA * np.sqrt(np.maximum(a + b * cen + c * cen**2, TINY))
+
+    def _gaussian_components(self, params, data_x):
+        # all peaks at once: rows are peaks, columns are data points
+        amp, cen, wid = self._peak_arrays(params)
+        wid = np.maximum(wid, TINY)[:, None]
+        u = (np.asarray(data_x, dtype=float) - cen[:, None]) / wid
+        shape = np.exp(-0.5 * u**2) / (SQRT_2PI * wid)
+        return amp, u, wid, shape
+
     def _gaussian_peaks(self, params, data_x):
-        return sum(
-            gaussian(data_x, params[f'amp_{i}'], params[f'cen_{i}'], params[f'wid_{i}'])
-            for i, peak in enumerate(self.peaks)
-        )
+        amp, _, _, shape = self._gaussian_components(params, data_x)
+        return amp @ shape
 
     def _linear_background(self, params, data_x):
         slope = params['line_slope']
         offset = params['line_off']
         return offset + data_x * slope
 
+    def _fixed_background(self, data_x):
+        if self.background is None:
+            return 0.0
+        if data_x is self.data_x:
+            return self.background
+        return np.interp(data_x, self.data_x, self.background)
+
     def residual(self, params, data_x, sigma=None, data_y=None):
-        model = self._gaussian_peaks(params, data_x) + self._linear_background(params, data_x)
+        model = (
+            self._gaussian_peaks(params, data_x) + self._linear_background(params, data_x)
+            + self._fixed_background(data_x)
+        )
 
         if data_y is None:
             return model
@@ -59,14 +134,61 @@ class PeakFitter:
             return model - data_y
         return (model - data_y) / sigma
 
-    def do_fit(self, verbosity=False):
-        PeakFitter.ith_fit += 1
+    def _width_derivatives(self, params):
+        # d wid_i / d wid_scale and d wid_i / d cen_i of the widths which follow the FWHM calibration
+        if self.fwhm_calibration is None:
+            return None, np.zeros(len(self.peaks))
+        _, b, c = self.fwhm_calibration
+        _, cen, _ = self._peak_arrays(params)
+        sigma = self._sigma_calibration(cen)
+        scale = self._values(params)['wid_scale']
+        return sigma, scale * FWHM_TO_SIGMA**2 * (b + 2 * c * cen) / (2 * sigma)
+
+    def jacobian(self, params, data_x, sigma=None, data_y=None):
+        # analytic derivatives of the residual over the varied parameters,
+        # one row per parameter (col_deriv=True)
+        var_names = [name for name, param in params.items() if param.vary and not param.expr]
+        jacobian = self._jacobian_rows(params, data_x, var_names)
+        if sigma is None:
+            return jacobian
+        return jacobian / sigma
+
+    def _jacobian_rows(self, params, data_x, var_names):
+        # the constrained centroids and widths contribute to their common
+        # parameters by the chain rule
+        amp, u, wid, shape = self._gaussian_components(params, data_x)
+        peaks = amp[:, None] * shape
+        d_wid = peaks * (u**2 - 1) / wid
+        wid_over_scale, wid_over_cen = self._width_derivatives(params)
+        d_cen = peaks * u / wid + wid_over_cen[:, None] * d_wid
+        peak_rows = {'amp': shape, 'cen': d_cen, 'wid': d_wid}
 
+        rows = []
+        for name in var_names:
+            if name == 'line_slope':
+                rows.append(np.asarray(data_x, dtype=float))
+            elif name == 'line_off':
+                rows.append(np.ones(shape.shape[1]))
+            elif name == 'cen_shift':
+                rows.append(d_cen[self._is_tied].sum(axis=0))
+            elif name == 'wid_scale':
+                rows.append(wid_over_scale @ d_wid)
+            else:
+                param_name, i = name.rsplit('_', 1)
+                rows.append(peak_rows[param_name][int(i)])
+        return np.array(rows)
+
+    def do_fit(self, verbosity=False, analytic_jacobian=True, iter_cb=None):
+        # iter_cb(params, iteration, resid, ...) is called after every function
+        # evaluation, the fit is aborted when it returns True
         myfit = Minimizer(self.residual, self.params,
-                          fcn_args=(self.data_x,), fcn_kws={'data_y': self.data_y},
-                          scale_covar=True)
+                          fcn_args=(self.data_x,), fcn_kws={'data_y': self.data_y, 'sigma': self.sigma},
+                          iter_cb=iter_cb, scale_covar=True)
 
-        self.result = myfit.leastsq()
+        if analytic_jacobian:
+            self.result = myfit.leastsq(Dfun=self.jacobian, col_deriv=True)
+        else:
+            self.result = myfit.leastsq()
         self.init = self.residual(self.params, self.data_x)
         self.fit = self.residual(self.result.params, self.data_x)
 
@@ -74,11 +196,86 @@ class PeakFitter:
             # print fit details out
             report_fit(self.result)
 
+    def refit(self, data_y, params=None):
+        # fit of other counts at the same data_x (e.g. resampled) started from the
+        # params (the best fit by default), without lmfit and the errors;
+        # amplitudes, centroids and widths of the peaks or None when the fit fails
+        params = self.result.params if params is None else params
+        var_names = [name for name, param in params.items() if param.vary and not param.expr]
+        values = dict(params.valuesdict())
+
+        def set_values(x):
+            values.update(zip(var_names, x))
+            return values
+
+        sigma = 1.0 if self.sigma is None else self.sigma
+        x, _, _, _, ier = leastsq(
+            lambda x: self.residual(set_values(x), self.data_x, sigma=self.sigma, data_y=data_y),
+            [values[name] for name in var_names],
+            Dfun=lambda x: self._jacobian_rows(set_values(x), self.data_x, var_names) / sigma,
+            col_deriv=True, full_output=True
+        )
+        if ier not in (1, 2, 3, 4):
+            return None
+        return self._peak_arrays(set_values(x))
+
     def get_result(self):
-        x = arange(self.data_x[0], self.data_x[-1], 0.1)
+        x = arange(self.data_x[0], self.data_x[-1], 0.1 * self.bin_width)
         return x, self.residual(self.result.params, x)
 
+    def _peak_errors(self):
+        # standard errors of the centroids and widths (also of the constrained ones)
+        # propagated from the covariance of the varied parameters
+        if self.result.covar is None:
+            return [None] * len(self.peaks), [None] * len(self.peaks)
+
+        index = {name: k for k, name in enumerate(self.result.var_names)}
+        wid_over_scale, wid_over_cen = self._width_derivatives(self.result.params)
+        d_cen = np.zeros((len(self.peaks), len(index)))
+        d_wid = np.zeros((len(self.peaks), len(index)))
+        for i in range(len(self.peaks)):
+            cen_name = 'cen_shift' if self._is_tied[i] else f'cen_{i}'
+            if cen_name in index:
+                d_cen[i, index[cen_name]] = 1.0
+            d_wid[i] = wid_over_cen[i] * d_cen[i]
+            wid_name = f'wid_{i}' if self.fwhm_calibration is None else 'wid_scale'
+            if wid_name in index:
+                d_wid[i, index[wid_name]] += 1.0 if self.fwhm_calibration is None else wid_over_scale[i]
+
+        covar = self.result.covar
+        return [
+            np.sqrt(np.einsum('ij,jk,ik->i', derivatives, covar, derivatives)).tolist()
+            for derivatives in (d_cen, d_wid)
+        ]
+
+    def get_peaks_parameters(self):
+        # best fit values and standard errors of every peak
+        # (amplitude of the lmfit gaussian is the peak area in counts * x units per bin)
+        _, cen, wid = self._peak_arrays(self.result.params)
+        cen_err, wid_err = self._peak_errors()
+        output = []
+        for i, _ in enumerate(self.peaks):
+            amp = self.result.params[f'amp_{i}']
+            output.append({
+                'centroid': float(cen[i]), 'centroid_err': cen_err[i],
+                'area': amp.value / self.bin_width,
+                'area_err': amp.stderr / self.bin_width if amp.stderr is not None else None,
+                'sigma': float(wid[i]), 'sigma_err': wid_err[i]
+            })
+        return output
+
     def generate_fit_report(self):
         report_header = f'\n\n{"="*10}\nFIT REPORT\n{"="*10}\n\n'
-        return report_header + fit_report(self.result.params)
+        if self.bin_width != 1.0:
+            # calibrated spectrum: amplitudes are areas multiplied by the bin width
+            report_header += f'x units per bin: {self.bin_width:.6g}\n'
+        report = report_header + fit_report(self.result.params)
+        if self._is_tied.any() or self.fwhm_calibration is not None:
+            # the constrained centroids and widths are not lmfit parameters
+            report += '\n[[Peaks]]\n' + ''.join(
+                f'    peak_{i}: cen = {peak["centroid"]:.4f} +/- {peak["centroid_err"] or 0:.4f}, '
+                f'wid = {peak["sigma"]:.4f} +/- {peak["sigma_err"] or 0:.4f}\n'
+                for i, peak in enumerate(self.get_peaks_parameters())
+            )
+        return report
 
@@ -0,0 +1,77 @@
+import numpy as np
+
+from spectview.datatypes import Peak
+import spectview.settings as settings
+
+
+def second_derivative_kernel(width):
+    # negative second derivative of a gaussian (sigma = width bins) with zero sum,
+    # so a constant or linear background gives no response
+    half_size = int(np.ceil(4 * width))
+    x = np.arange(-half_size, half_size + 1, dtype=float)
+    kernel = (1 - (x / width)**2) * np.exp(-0.5 * (x / width)**2)
+    return kernel - kernel.mean()
+
+
+def _convolve_last_axis(spectra, kernel):
+    # 'same' convolution of every row at once in the Fourier space
+    n_bins = spectra.shape[-1]
+    n_fft = 1 << int(np.ceil(np.log2(n_bins + len(kernel) - 1)))
+    convolved = np.fft.irfft(
+        np.fft.rfft(spectra, n_fft, axis=-1) * np.fft.rfft(kernel, n_fft), n_fft, axis=-1
+    )
+    half_size = len(kernel) // 2
+    return convolved[..., half_size:half_size + n_bins]
+
+
+def peak_significance(spectra, width=None):
+    # filter response in units of its Poisson standard deviation, for one
+    # spectrum or a (spectra, bins) stack
+    width = width or settings.PEAK_SEARCH_WIDTH
+    kernel = second_derivative_kernel(width)
+    spectra = np.asarray(spectra, dtype=float)
+
+    response = _convolve_last_axis(spectra, kernel)
+    variance = _convolve_last_axis(np.maximum(spectra, 1), kernel**2)
+    significance = response / np.sqrt(np.maximum(variance, 1e-12))
+
+    # the filter does not see the whole peak shape near the edges
+    half_size = len(kernel) // 2
+    significance[..., :half_size] = 0
+    significance[..., -half_size:] = 0
+    return significance
+
+
+def _local_maxima(significance, threshold):
+    center = significance[..., 1:-1]
+    left = significance[..., :-2]
+    right = significance[..., 2:]
+    is_peak = (center > left) & (center >= right) & (center > threshold)
+    *rows, columns = np.nonzero(is_peak)
+
+    # sub-bin position from the parabola through the maximum and its neighbours
+    l, c, r = left[is_peak], center[is_peak], right[is_peak]
+    curvature = l - 2 * c + r
+    offset = np.where(curvature < 0, 0.5 * (l - r) / np.where(curvature < 0, curvature, -1), 0)
+    return rows, columns + 1, offset
+
+
+def find_peaks_stack(spectra, data_x=None, width=None, threshold=None):
+    # list of the found peaks for every spectrum of the (spectra, bins) stack
+    spectra = np.atleast_2d(spectra)
+    threshold = settings.PEAK_SEARCH_SIGNIFICANCE if threshold is None else threshold
+    significance = peak_significance(spectra, width=width)
+
+    (rows,), columns, offset = _local_maxima(significance, threshold)
+    bins = np.arange(spectra.shape[-1])
+    centroids = columns + offset if data_x is None else np.interp(columns + offset, bins, data_x)
+    amplitudes = spectra[rows, columns]
+
+    found = [[] for _ in range(spectra.shape[0])]
+    for row, centroid, amp in zip(rows, centroids, amplitudes):
+        found[row].append(Peak(float(centroid), float(amp)))
+    return found
+
+
+def find_peaks(data_y, data_x=None, width=None, threshold=None):
+    return find_peaks_stack(data_y, data_x=data_x, width=width, threshold=threshold)[0]
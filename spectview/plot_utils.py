@@ -1,12 +1,19 @@
-import matplotlib.pyplot as plt
+from contextlib import contextmanager
+
+from matplotlib.widgets import TextBox
 import spectview.settings as settings
+from spectview.lod import MinMaxPyramid
+from spectview.range_max import RangeMaxIndex
 
 class PlotManager:
 
     def __init__(self, window_object):
         self.window_object = window_object
         self.name_to_line2d = {}
+        self.name_to_lod = {}
+        self.line2d_to_range_max = {}
         self.plot_setup = {}
+        self.window_object.ax.callbacks.connect('xlim_changed', self.update_level_of_detail)
 
     def add_plot(self, name, data_x, data_y):
         if name in self.name_to_line2d.keys():
@@ -17,17 +24,63 @@ class PlotManager:
                 data_x, data_y, **self.plot_setup
             )
             self.name_to_line2d[name] = line2d_obj
+            self.line2d_to_range_max[line2d_obj] = RangeMaxIndex(data_x, data_y)
+
+            # big spectra are drawn with a decimated copy of the data
+            if len(data_x) > settings.LOD_MIN_POINTS:
+                self.name_to_lod[name] = MinMaxPyramid(data_x, data_y)
+                self._set_level_of_detail(name)
             return line2d_obj
 
     def remove_plot(self, name):
         try:
             # remove from plot
-            self.window_object.ax.lines.remove(self.name_to_line2d[name])
+            self.name_to_line2d[name].remove()
             # remove from PlotManager registry
+            self.line2d_to_range_max.pop(self.name_to_line2d[name], None)
             del self.name_to_line2d[name]
+            self.name_to_lod.pop(name, None)
         except KeyError:
             print('Nothing to remove.')
 
+    def update_plot(self, name, data_x, data_y):
+        # new data of the plotted line, e.g. of a growing spectrum
+        line2d_obj = self.name_to_line2d[name]
+        self.line2d_to_range_max[line2d_obj] = RangeMaxIndex(data_x, data_y)
+        if len(data_x) > settings.LOD_MIN_POINTS:
+            self.name_to_lod[name] = MinMaxPyramid(data_x, data_y)
+            self._set_level_of_detail(name)
+        else:
+            line2d_obj.set_data(data_x, data_y)
+
+    def get_data(self, line2d_obj):
+        # full resolution data of the line (the drawn one can be decimated)
+        for name, line in self.name_to_line2d.items():
+            if line is line2d_obj and name in self.name_to_lod:
+                lod = self.name_to_lod[name]
+                return lod.data_x, lod.data_y
+        return line2d_obj.get_data(orig=True)
+
+    def get_max(self, line2d_obj, x1, x2):
+        # maximum of the line in the [x1, x2] range (None for not managed lines)
+        range_max = self.line2d_to_range_max.get(line2d_obj)
+        if range_max is None:
+            return None
+        try:
+            return range_max.max_in_range(x1, x2)
+        except ValueError:
+            return None
+
+    def _set_level_of_detail(self, name):
+        ax = self.window_object.ax
+        max_points = int(settings.LOD_POINTS_PER_PIXEL * ax.bbox.width)
+        self.name_to_line2d[name].set_data(*self.name_to_lod[name].get_view(*ax.get_xlim(), max_points))
+
+    def update_level_of_detail(self, ax=None):
+        # called on every x axis limits change, before the figure is drawn
+        for name in self.name_to_lod:
+            self._set_level_of_detail(name)
+
     def mark_plot(self, name):
         self.name_to_line2d[name].set_linewidth(2)
 
@@ -36,6 +89,72 @@ class PlotManager:
         return {v.__repr__(): k for k, v in self.name_to_line2d.items()}
 
 
+class BlitManager:
+    # the static part of the figure is cached once per view (on every full draw),
+    # the animated overlay artists are drawn over it and blitted
+
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.background = None
+        self.artists = []
+        self.updaters = {}
+        self.cid = self.canvas.mpl_connect('draw_event', self.on_draw)
+
+    def add_artist(self, artist, updater=None):
+        # updater is called before the artist is drawn, e.g. to sync its data
+        artist.set_animated(True)
+        self.artists.append(artist)
+        if updater:
+            self.updaters[artist] = updater
+
+    def remove_artist(self, artist):
+        if artist in self.artists:
+            self.artists.remove(artist)
+            self.updaters.pop(artist, None)
+
+    def on_draw(self, event):
+        # ignore drawing of the figure saved to a file
+        if event.canvas is not self.canvas or self.canvas.is_saving():
+            return
+        self.background = self.canvas.copy_from_bbox(self.canvas.figure.bbox)
+        self._draw_artists()
+
+    def _draw_artists(self):
+        for artist in self.artists:
+            if artist in self.updaters:
+                self.updaters[artist]()
+            self.canvas.figure.draw_artist(artist)
+
+    def update(self):
+        if self.background is None or not getattr(self.canvas, 'supports_blit', False):
+            self.canvas.draw_idle()
+            return
+        self.canvas.restore_region(self.background)
+        self._draw_artists()
+        self.canvas.blit(self.canvas.figure.bbox)
+        self.canvas.flush_events()
+
+    @contextmanager
+    def static_artists(self):
+        # animated artists are skipped when a figure is saved
+        for artist in self.artists:
+            artist.set_animated(False)
+        try:
+            yield
+        finally:
+            for artist in self.artists:
+                artist.set_animated(True)
+
+
+class LazyTextBox(TextBox):
+    # matplotlib's TextBox redraws the whole canvas on every click outside
+    # of it, even when nothing was typed
+
+    def stop_typing(self):
+        if self.capturekeystrokes:
+            super().stop_typing()
+
+
 class ClickCatcher:
 
     def __init__(self, window_obj):
@@ -52,7 +171,9 @@ class ClickCatcher:
         self.data_y = []
 
     def initialize_plotting(self):
-        return self.window.ax.plot([], [], **settings.CLICK_CATCHER_PLOT_SETUP)[0]
+        points = self.window.ax.plot([], [], **settings.CLICK_CATCHER_PLOT_SETUP)[0]
+        self.window.blit_manager.add_artist(points)
+        return points
 
     def __call__(self, event):
         # ignore toolbar operations like zoom
@@ -82,7 +203,7 @@ class ClickCatcher:
 
     def update(self):
         self.points.set_data(self.data_x, self.data_y)
-        self.window.fig.canvas.draw()
+        self.window.blit_manager.update()
 
     def disconnect(self):
         # disconnect click-catching
@@ -102,14 +223,17 @@ class ClickCatcher:
         return self.data_x, self.data_y
 
     def remove_plot(self):
+        self.window.blit_manager.remove_artist(self.points)
         self.points.remove()
-        self.window.fig.canvas.draw()
+        self.window.blit_manager.update()
 
 
 class PeakCatcher(ClickCatcher):
 
     def initialize_plotting(self):
-        return self.window.ax.plot([], [], **settings.PEAK_CATCHER_PLOT_SETUP)[0]
+        points = self.window.ax.plot([], [], **settings.PEAK_CATCHER_PLOT_SETUP)[0]
+        self.window.blit_manager.add_artist(points)
+        return points
 
 
 class SpectrumSelector:
@@ -121,17 +245,31 @@ class SpectrumSelector:
         self._selected_spectrum = None
         self._is_highlighted = False
 
+        # the highlighted spectrum is drawn over the cached background as a thick copy
+        self.highlight = self.window.ax.plot([], [], **settings.HIGHLIGHT_PLOT_SETUP)[0]
+        self.highlight.set_visible(False)
+        self.window.blit_manager.add_artist(self.highlight, updater=self.update_highlight)
+
     def __call__(self, event):
         if self.window.is_click_catcher_working:
             pass
         else:
             self.selected_spectrum = event.artist
-            plt.draw()
 
     def set_non_event_selection(self, line2d_obj):
         # for auto selection when spectrum is added to the plot
         self.selected_spectrum = line2d_obj
-        self.selected_spectrum.set_linewidth(1)
+        self._is_highlighted = False
+
+    def update_highlight(self):
+        line = self._selected_spectrum
+        is_visible = self._is_highlighted and line is not None and line in self.window.ax.lines
+        self.highlight.set_visible(is_visible)
+        if is_visible:
+            self.highlight.set_data(*line.get_data())
+            self.highlight.set_color(line.get_color())
+            self.highlight.set_drawstyle(line.get_drawstyle())
+            self.highlight.set_linestyle(line.get_linestyle())
 
     @property
     def selected_spectrum(self):
@@ -139,18 +277,11 @@ class SpectrumSelector:
 
     @selected_spectrum.setter
     def selected_spectrum(self, new_spectrum):
-        if self._selected_spectrum == new_spectrum and not self._is_highlighted:
-            self._is_highlighted = True
-            self._selected_spectrum.set_linewidth(2)
-
-        elif self._selected_spectrum == new_spectrum and self._is_highlighted:
-            self._is_highlighted = False
-            self._selected_spectrum.set_linewidth(1)
-
-        elif self._is_highlighted != new_spectrum:
-            if self.selected_spectrum:
-                self._selected_spectrum.set_linewidth(1)
+        if self._selected_spectrum == new_spectrum:
+            self._is_highlighted = not self._is_highlighted
+        else:
             self._selected_spectrum = new_spectrum
-            self._selected_spectrum.set_linewidth(2)
+            self._is_highlighted = True
 
-        self.window.selected_spectrum = self.selected_spectrum
+        # only the overlay is redrawn, unless the y axis has to be rescaled
+        self.window.select_spectrum(self.selected_spectrum, full_redraw=False)
@@ -0,0 +1,219 @@
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+import spectview.settings as settings
+from spectview.datatypes import DataSet, GateInfo
+from spectview.hdf5_matrix import HDF5Matrix, window_to_slice
+
+
+class LRUCache:
+
+    def __init__(self, maxsize, on_evict=None):
+        self.maxsize = maxsize
+        self.on_evict = on_evict
+        self._items = OrderedDict()
+
+    def get(self, key, default=None):
+        if key not in self._items:
+            return default
+        self._items.move_to_end(key)
+        return self._items[key]
+
+    def __setitem__(self, key, value):
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            _, evicted = self._items.popitem(last=False)
+            if self.on_evict is not None:
+                self.on_evict(evicted)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def items(self):
+        return list(self._items.items())
+
+    def clear(self):
+        self._items.clear()
+
+
+class Projector:
+    # gate - k*bg projections of a gamma-gamma matrix (y, x) or a gamma-gamma-gamma
+    # cube (z, y, x) computed from the running sums over the y axis, so a gate
+    # window is only a difference of two rows of the prefix sums
+
+    def __init__(self, matrix, prefix_cache_size=None, result_cache_size=None):
+        if isinstance(matrix, str):
+            matrix = HDF5Matrix(matrix)
+        self.matrix = matrix
+        self.source_file = getattr(matrix, 'file', '')
+
+        self._prefix_cache = LRUCache(prefix_cache_size or settings.PROJECTION_PREFIX_CACHE_SIZE)
+        self._result_cache = LRUCache(result_cache_size or settings.PROJECTION_RESULT_CACHE_SIZE)
+
+    @property
+    def ndim(self):
+        return self.matrix.ndim
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    def _bounds(self, window):
+        # ((z_start, z_stop), (y_start, y_stop)) of the bins in a gate window
+        if isinstance(window, GateInfo):
+            gate_z, gate_y = window.gate_z, window.gate_y
+        else:
+            gate_z, gate_y = window
+
+        if self.ndim == 2:
+            z_bounds = None
+        else:
+            z_slice = window_to_slice(gate_z, self.shape[0])
+            z_bounds = (z_slice.start, max(z_slice.start, z_slice.stop))
+        y_slice = window_to_slice(gate_y, self.shape[-2])
+        return z_bounds, (y_slice.start, max(y_slice.start, y_slice.stop))
+
+    @staticmethod
+    def _area(bounds):
+        z_bounds, (y_start, y_stop) = bounds
+        area = y_stop - y_start
+        if z_bounds is not None:
+            area *= max(0, z_bounds[1] - z_bounds[0])
+        return area
+
+    def normalization(self, gates, backgrounds):
+        # the background is scaled to the number of gated bins
+        bg_area = sum(self._area(bounds) for bounds in backgrounds)
+        if not bg_area:
+            return 0.0
+        return sum(self._area(bounds) for bounds in gates) / bg_area
+
+    @property
+    def accumulator_dtype(self):
+        if isinstance(self.matrix, HDF5Matrix):
+            return self.matrix.accumulator_dtype
+        if np.issubdtype(self.matrix.dtype, np.integer):
+            return np.int64
+        return np.float64
+
+    def _sum_planes(self, start, stop):
+        if isinstance(self.matrix, HDF5Matrix):
+            return self.matrix.sum_planes(slice(start, stop))
+        return self.matrix[start:stop].sum(axis=0, dtype=self.accumulator_dtype)
+
+    @staticmethod
+    def _cumsum(plane):
+        prefix = np.zeros((plane.shape[0] + 1, plane.shape[1]), dtype=plane.dtype)
+        np.cumsum(plane, axis=0, out=prefix[1:])
+        return prefix
+
+    def _nudged_prefix_sums(self, z_bounds):
+        # reuse the prefix sums of the closest cached z gate, only the z planes
+        # which differ between both gates are read
+        start, stop = z_bounds
+        closest = None
+        for (cached_start, cached_stop), prefix in self._prefix_cache.items():
+            cost = abs(start - cached_start) + abs(stop - cached_stop)
+            if closest is None or cost < closest[0]:
+                closest = (cost, cached_start, cached_stop, prefix)
+
+        if closest is None or closest[0] >= stop - start:
+            return None
+
+        _, cached_start, cached_stop, prefix = closest
+        plane = np.zeros(self.shape[1:], dtype=prefix.dtype)
+        for low, high in ((start, cached_start), (cached_stop, stop)):
+            if low < high:
+                plane += self._sum_planes(low, high)
+            elif high < low:
+                plane -= self._sum_planes(high, low)
+        return prefix + self._cumsum(plane)
+
+    def _prefix_sums(self, z_bounds):
+        prefix = self._prefix_cache.get(z_bounds)
+        if prefix is not None:
+            return prefix
+
+        if self.ndim == 2:
+            if isinstance(self.matrix, HDF5Matrix):
+                prefix = self.matrix.y_prefix_sums()
+            else:
+                prefix = self._cumsum(self.matrix.astype(self.accumulator_dtype))
+        else:
+            prefix = self._nudged_prefix_sums(z_bounds)
+            if prefix is None:
+                prefix = self._cumsum(self._sum_planes(*z_bounds))
+
+        self._prefix_cache[z_bounds] = prefix
+        return prefix
+
+    def project(self, gates, backgrounds=(), k=None):
+        gates = [self._bounds(window) for window in gates]
+        backgrounds = [self._bounds(window) for window in backgrounds]
+        if k is None:
+            k = self.normalization(gates, backgrounds)
+
+        key = (tuple(gates), tuple(backgrounds), float(k))
+        spectrum = self._result_cache.get(key)
+        if spectrum is not None:
+            return spectrum
+
+        # windows sharing the z gate are reduced together:
+        # weights @ (prefix[y_stop] - prefix[y_start])
+        windows_by_z = {}
+        for bounds, weight in zip(gates + backgrounds, [1.0] * len(gates) + [-k] * len(backgrounds)):
+            z_bounds, y_bounds = bounds
+            windows_by_z.setdefault(z_bounds, []).append((*y_bounds, weight))
+
+        spectrum = np.zeros(self.shape[-1], dtype=np.float64)
+        for z_bounds, windows in windows_by_z.items():
+            prefix = self._prefix_sums(z_bounds)
+            y_start, y_stop, weights = np.array(windows).T
+            spectrum += weights @ (prefix[y_stop.astype(int)] - prefix[y_start.astype(int)])
+
+        if not backgrounds:
+            spectrum = spectrum.round().astype(np.int64)
+        spectrum.setflags(write=False)
+        self._result_cache[key] = spectrum
+        return spectrum
+
+    def get_dataset(self, gates, backgrounds=(), k=None, type_='gate'):
+        spectrum = self.project(gates, backgrounds=backgrounds, k=k)
+
+        first_gate = gates[0]
+        if isinstance(first_gate, GateInfo):
+            gate = first_gate
+        else:
+            gate = GateInfo.from_gate_windows(
+                self.source_file, gate_z=first_gate[0], gate_y=first_gate[1], type_=type_
+            )
+        return DataSet(spectrum=spectrum, gate=gate)
+
+    def clear_cache(self):
+        self._prefix_cache.clear()
+        self._result_cache.clear()
+
+    def close(self):
+        if isinstance(self.matrix, HDF5Matrix):
+            self.matrix.close()
+
+
+# the Projectors of the .h5 files whose gate windows are being tuned (by their path and
+# modification time), so the next gates of the same file come from the cached prefix sums;
+# a single gate is read directly by DataSet.from_hdf5
+_projectors = LRUCache(settings.PROJECTOR_CACHE_SIZE, on_evict=Projector.close)
+
+
+def projector_for(file):
+    key = (os.path.abspath(file), os.stat(file).st_mtime_ns)
+    projector = _projectors.get(key)
+    if projector is None:
+        projector = Projector(file)
+        _projectors[key] = projector
+    return projector
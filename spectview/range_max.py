@@ -0,0 +1,54 @@
+import numpy as np
+
+
+class RangeMaxIndex:
+    # maximum of data_y over any x range: sparse table over the maxima of the
+    # blocks of BLOCK_SIZE bins plus a direct look at the two partial blocks,
+    # so a query costs O(BLOCK_SIZE) at most and the index is smaller than the data
+
+    BLOCK_SIZE = 64
+
+    def __init__(self, data_x, data_y):
+        self.data_x = np.asarray(data_x)
+        self.data_y = np.asarray(data_y)
+
+        n_blocks = -(-len(self.data_y) // self.BLOCK_SIZE)
+        padded = np.full(n_blocks * self.BLOCK_SIZE, -np.inf)
+        padded[:len(self.data_y)] = self.data_y
+        block_maxima = padded.reshape(n_blocks, self.BLOCK_SIZE).max(axis=1)
+
+        # sparse_table[k][i] = max(block_maxima[i: i + 2**k])
+        self.sparse_table = [block_maxima]
+        width = 1
+        while 2 * width <= n_blocks:
+            previous = self.sparse_table[-1]
+            self.sparse_table.append(np.maximum(previous[:-width], previous[width:]))
+            width *= 2
+
+    def _blocks_max(self, first_block, last_block):
+        level = (last_block - first_block).bit_length() - 1
+        table = self.sparse_table[level]
+        return max(table[first_block], table[last_block - (1 << level)])
+
+    def max_of_slice(self, start, stop):
+        start, stop = max(0, int(start)), min(len(self.data_y), int(stop))
+        if stop <= start:
+            raise ValueError('No data in the range')
+
+        first_block = -(-start // self.BLOCK_SIZE)
+        last_block = stop // self.BLOCK_SIZE
+        if first_block >= last_block:
+            return self.data_y[start:stop].max()
+
+        partial_blocks = [
+            self.data_y[start:first_block * self.BLOCK_SIZE],
+            self.data_y[last_block * self.BLOCK_SIZE:stop]
+        ]
+        return max(
+            [self._blocks_max(first_block, last_block)] + [part.max() for part in partial_blocks if len(part)]
+        )
+
+    def max_in_range(self, x1, x2):
+        start = np.searchsorted(self.data_x, x1, side='left')
+        stop = np.searchsorted(self.data_x, x2, side='right')
+        return self.max_of_slice(int(start), int(stop))
@@ -0,0 +1,167 @@
+#!/usr/bin/python3
+# Fit results and marked points of all spectra in one SQLite database,
+# indexed by the gate and the energy.
+#
+# usage: python3 -m spectview.results_store 583 [--tolerance 1.5] [--gate gate_g1436g444] [--marked]
+import os
+import sys
+import sqlite3
+import argparse
+from datetime import datetime
+
+import spectview.settings as settings
+
+FIT_FIELDS = [
+    'timestamp', 'file', 'gate', 'range_low', 'range_high', 'peak',
+    'centroid', 'centroid_err', 'area', 'area_err', 'sigma', 'sigma_err',
+    'chisqr', 'redchi', 'nfev'
+]
+MARKED_POINT_FIELDS = ['timestamp', 'gate', 'energy', 'counts']
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS fits (
+    id INTEGER PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    file TEXT,
+    gate TEXT NOT NULL,
+    range_low REAL,
+    range_high REAL,
+    peak INTEGER,
+    centroid REAL NOT NULL,
+    centroid_err REAL,
+    area REAL,
+    area_err REAL,
+    sigma REAL,
+    sigma_err REAL,
+    chisqr REAL,
+    redchi REAL,
+    nfev INTEGER
+);
+CREATE INDEX IF NOT EXISTS fits_gate_centroid ON fits (gate, centroid);
+CREATE INDEX IF NOT EXISTS fits_centroid ON fits (centroid);
+
+CREATE TABLE IF NOT EXISTS marked_points (
+    id INTEGER PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    gate TEXT NOT NULL,
+    energy REAL NOT NULL,
+    counts REAL
+);
+CREATE INDEX IF NOT EXISTS marked_points_gate_energy ON marked_points (gate, energy);
+CREATE INDEX IF NOT EXISTS marked_points_energy ON marked_points (energy);
+'''
+
+
+def now():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def fit_rows(peak_fit, **row):
+    # one row per fitted peak, `row` holds the common fields (gate, file, range, ...)
+    fit_statistics = {
+        'chisqr': float(peak_fit.result.chisqr),
+        'redchi': float(peak_fit.result.redchi),
+        'nfev': int(peak_fit.result.nfev),
+        'success': bool(peak_fit.result.success)
+    }
+    return [
+        dict(row, peak=i, **peak_parameters, **fit_statistics)
+        for i, peak_parameters in enumerate(peak_fit.get_peaks_parameters())
+    ]
+
+
+class ResultsStore:
+
+    def __init__(self, file=None):
+        self.file = file or settings.RESULTS_DATABASE
+        directory = os.path.dirname(self.file)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.connection = sqlite3.connect(self.file)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def _insert(self, table, fields, rows):
+        timestamp = now()
+        values = [
+            tuple(row.get(field, timestamp if field == 'timestamp' else None) for field in fields)
+            for row in rows
+        ]
+        with self.connection:
+            self.connection.executemany(
+                f'INSERT INTO {table} ({", ".join(fields)}) VALUES ({", ".join("?" * len(fields))})', values
+            )
+        return len(values)
+
+    def add_fits(self, rows):
+        # rows as from fit_rows (or the batch fitting), the failed fits are skipped
+        return self._insert('fits', FIT_FIELDS, [row for row in rows if row.get('centroid') is not None])
+
+    def add_marked_points(self, gate, points):
+        return self._insert(
+            'marked_points', MARKED_POINT_FIELDS,
+            [{'gate': gate, 'energy': float(x), 'counts': float(y)} for x, y in points]
+        )
+
+    def _near(self, table, column, energy, tolerance, gate):
+        tolerance = settings.RESULTS_QUERY_TOLERANCE if tolerance is None else tolerance
+        query = f'SELECT * FROM {table} WHERE {column} BETWEEN ? AND ?'
+        parameters = [energy - tolerance, energy + tolerance]
+        if gate is not None:
+            query += ' AND gate = ?'
+            parameters.append(gate)
+        query += f' ORDER BY ABS({column} - ?), timestamp'
+        parameters.append(energy)
+        return [dict(row) for row in self.connection.execute(query, parameters)]
+
+    def fits_near(self, energy, tolerance=None, gate=None):
+        return self._near('fits', 'centroid', energy, tolerance, gate)
+
+    def marked_points_near(self, energy, tolerance=None, gate=None):
+        return self._near('marked_points', 'energy', energy, tolerance, gate)
+
+    def fits_of_gate(self, gate):
+        return [dict(row) for row in self.connection.execute(
+            'SELECT * FROM fits WHERE gate = ? ORDER BY centroid', (gate,)
+        )]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Find the stored fits (or marked points) near the energy.')
+    parser.add_argument('energy', type=float)
+    parser.add_argument('-t', '--tolerance', type=float, default=None)
+    parser.add_argument('-g', '--gate', default=None)
+    parser.add_argument('-m', '--marked', action='store_true', help='marked points instead of the fits')
+    parser.add_argument('--db', default=None, help='database file')
+    args = parser.parse_args(argv)
+
+    with ResultsStore(args.db) as store:
+        if args.marked:
+            rows = store.marked_points_near(args.energy, args.tolerance, args.gate)
+            print(f'{"gate":<24} {"energy":>10} {"counts":>10}  timestamp')
+            for row in rows:
+                print(f'{row["gate"]:<24} {row["energy"]:>10.2f} {row["counts"]:>10.1f}  {row["timestamp"]}')
+        else:
+            rows = store.fits_near(args.energy, args.tolerance, args.gate)
+            print(f'{"gate":<24} {"centroid":>10} {"err":>7} {"area":>10} {"err":>8} {"sigma":>7}  timestamp')
+            for row in rows:
+                print(
+                    f'{row["gate"]:<24} {row["centroid"]:>10.2f} {row["centroid_err"] or 0:>7.2f} '
+                    f'{row["area"] or 0:>10.1f} {row["area_err"] or 0:>8.1f} {row["sigma"] or 0:>7.2f}'
+                    f'  {row["timestamp"]}'
+                )
+    print(f'{len(rows)} found.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,3 +1,5 @@
+import os
+
 SPECTRUM_BINS = 4096
 
 KEYMAP = {
@@ -17,7 +19,12 @@ KEYMAP = {
     'v': 'activate_marking',
     'b': 'print_marked_points',
     'r': 'remove_plot',
-    'a': 'add_spectrum_from_file'
+    'a': 'add_spectrum_from_file',
+    't': 'print_action_timing',
+    'k': 'show_background',
+    'c': 'cancel_fits',
+    'u': 'bootstrap_fit',
+    'G': 'do_global_fit'
 }
 
 # button height
@@ -48,6 +55,9 @@ BUTTONS = {
 
 TEXT_BOXES = {
     "search_gamma": ([0.92, 0.92, BW, BH], 'Show energy', 0.05, 'show_peak'),
+    "calibrate": ([0.33, 0.92, BW, BH], 'Calibrate', 0.05, 'calibrate'),
+    "find": ([0.47, 0.92, BW, BH], 'Find', 0.03, 'find_spectra'),
+    "expression": ([0.61, 0.92, BW, BH], 'Expr', 0.03, 'add_expression'),
 }
 
 RADIO_BUTTONS = {
@@ -80,6 +90,45 @@ SHOW_PEAK_WINDOW_WIDTH = 400
 OUTPUT_FIGURES_PATH = './pictures/'
 OUTPUT_MARKED_PEAKS_PATH = './peaks/'
 OUTPUT_FIT_RESULTS_PATH = './fits/'
+OUTPUT_TIMING_PATH = './timing/'
+
+# catalog of the spectra files searched with the 'Find' box (e.g. 'gate 1436 444'):
+# the directory, the gammas tolerance, number of the loading threads and
+# the maximal number of the spectra plotted at once
+CATALOG_DIRECTORY = '.'
+CATALOG_TOLERANCE = 2
+CATALOG_LOAD_WORKERS = 8
+CATALOG_MAX_PLOTTED = 10
+
+# SQLite database of the reported fits and marked points (None - text files only)
+# and the default +/- energy range of its queries
+RESULTS_DATABASE = './fits/spectview_results.sqlite'
+RESULTS_QUERY_TOLERANCE = 1.0
+
+# energy calibration used when there is no '<spectrum name>.cal' file next to
+# the spectrum (None - x axis in bins); the degree of the calibrations fitted to peaks
+CALIBRATION_FILE = None
+CALIBRATION_DEGREE = 1
+
+# list mode files: the record type, the field with the energy channel, number of
+# records read at once and the refresh interval [ms] of the live spectra
+LIST_MODE_RECORD = [('time', '<u8'), ('detector', '<u2'), ('energy', '<u2')]
+LIST_MODE_ENERGY_FIELD = 'energy'
+LIST_MODE_CHUNK_SIZE = 2**20
+LIVE_REFRESH_INTERVAL = 500
+
+# gamma-gamma matrices from the list mode files: the coincidence window (in the
+# time units of the records), the farthest record checked for a coincidence and the matrix size
+COINCIDENCE_WINDOW = 100
+COINCIDENCE_MAX_LAG = 8
+MATRIX_BINS = 2048
+
+# binary copies of the loaded text spectra, reused while the file is unchanged
+USE_SPECTRUM_CACHE = True
+SPECTRUM_CACHE_PATH = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'spectview')
+# the least recently used entries are removed above the size (bytes), the unused ones after the age (s)
+SPECTRUM_CACHE_MAX_SIZE = 256 * 2**20
+SPECTRUM_CACHE_MAX_AGE = 30 * 24 * 3600
 
 X_AXIS_MOVING_FACTOR = 0.15
 Y_AXIS_MOVING_FACTOR = 0.15
@@ -87,9 +136,54 @@ X_AXIS_STRETCH_FACTOR = 8
 Y_AXIS_COLLAPSE_SCALE_FACTOR = 2
 Y_AXIS_EXPAND_SCALE_FACTOR = 0.8
 
+# automatic peak search: width (sigma in bins) of the smoothed second
+# derivative filter and the minimal significance of a peak
+PEAK_SEARCH_WIDTH = 1.5
+PEAK_SEARCH_SIGNIFICANCE = 4.0
+
+# spectra longer than LOD_MIN_POINTS bins are drawn decimated to the
+# LOD_POINTS_PER_PIXEL minimum/maximum points per pixel of the current view
+LOD_MIN_POINTS = 8192
+LOD_POINTS_PER_PIXEL = 2
+
+# y autoscale to all visible spectra and fit curves (not only the selected one)
+AUTOSCALE_ALL_LINES = False
+
+# SNIP background: number of the clipping passes (about the peak width in bins),
+# half width of the moving average smoothing before the clipping (0 - none)
+# and the background of the fits, 'linear' (fitted) or 'snip' (fixed, with a free offset)
+SNIP_ITERATIONS = 24
+SNIP_SMOOTHING = 2
+FIT_BACKGROUND = 'linear'
+
+# FWHM^2 = a + b*x + c*x^2 (x units of the spectrum): when it is given the widths
+# of the fitted peaks follow it, multiplied by one common (free or fixed) scale
+FWHM_CALIBRATION = None
+FIT_FREE_WIDTH_SCALE = True
+
+# time of every key/button action split into the handler and the drawing,
+# statistics of the last ACTION_TIMING_WINDOW calls are printed with the 't' key
+ACTION_TIMING = False
+ACTION_TIMING_WINDOW = 100
+
 # print info during plot
 FIT_VERBOSITY = True
 
+# number of the evaluated spectrum expressions (e.g. gate_g1436g444 - 0.3*bg_g1436g444,
+# the 'Expr' box) kept in the memory
+EXPRESSION_CACHE_SIZE = 16
+
+# Poisson bootstrap of the last fit (the 'u' key): number of resampled refits,
+# confidence of the percentile intervals and worker processes (None - all CPUs)
+BOOTSTRAP_SAMPLES = 1000
+BOOTSTRAP_CONFIDENCE = 0.683
+BOOTSTRAP_WORKERS = None
+
+# the fits run in a background thread, so the window is not blocked
+# (cancel them with the 'c' key), the finished ones are plotted every FIT_POLL_INTERVAL ms
+FIT_IN_BACKGROUND = True
+FIT_POLL_INTERVAL = 100
+
 # matplotlib.pyplot parameters
 CLICK_CATCHER_PLOT_SETUP = {
     'marker': '+',
@@ -125,6 +219,11 @@ FIT_PLOT_SETUP = {
     'picker': 10
 }
 
+# matplotlib.pyplot parameters (color and drawstyle are taken from the spectrum)
+HIGHLIGHT_PLOT_SETUP = {
+    'linewidth': 2
+}
+
 # matplotlib.pyplot.text parameters
 GATE_NAME_BOX_SETUP = {
     'x': 0.9,
@@ -133,6 +232,26 @@ GATE_NAME_BOX_SETUP = {
     'horizontalalignment': 'right'
 }
 
+# matplotlib.pyplot.text parameters
+FIT_STATUS_BOX_SETUP = {
+    'x': 0.9,
+    'y': 0.81,
+    'fontsize': 9,
+    'horizontalalignment': 'right'
+}
+
+# HDF5 gamma-gamma matrices and gamma-gamma-gamma cubes
+# name of the dataset inside the file (None - first 2D or 3D dataset found)
+HDF5_DATASET_NAME = None
+# maximal number of matrix elements read from the file at once
+HDF5_READ_BLOCK_SIZE = 2**24
+# number of y prefix sums (one per z gate of a cube) kept by the Projector
+PROJECTION_PREFIX_CACHE_SIZE = 2
+# number of projected spectra kept by the Projector
+PROJECTION_RESULT_CACHE_SIZE = 128
+# number of .h5 files (with their Projectors and prefix sums) kept open by projection.projector_for
+PROJECTOR_CACHE_SIZE = 2
+
 DATA_FILETYPES = [
     ('txt', '*.txt'),
     ('hdf5', '*.h5'),
@@ -0,0 +1,110 @@
+import os
+import time
+import hashlib
+import warnings
+
+import numpy as np
+
+import spectview.settings as settings
+
+
+def read_header(file):
+    # leading '#' comment lines of a text spectrum
+    header = []
+    with open(file) as f:
+        for line in f:
+            if not line.startswith('#'):
+                break
+            header.append(line.lstrip('#').strip())
+    return header
+
+
+def parse_txt_spectrum(file):
+    with open(file) as f:
+        text = ''.join(line for line in f if not line.startswith('#'))
+
+    # np.fromstring parses the whole column in C, it stops (warns or raises,
+    # depending on numpy version) on anything which is not an integer
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', DeprecationWarning)
+            spectrum = np.fromstring(text, dtype=np.int64, sep=' ')
+    except (ValueError, DeprecationWarning):
+        spectrum = None
+
+    if spectrum is None or len(spectrum) != len(text.split()):
+        spectrum = np.genfromtxt(file, dtype=int)
+    return spectrum
+
+
+def cache_file_path(file):
+    # the cache entry is keyed on the file path, size and modification time
+    stat = os.stat(file)
+    key = '{}:{}:{}'.format(os.path.abspath(file), stat.st_size, stat.st_mtime_ns)
+    name = hashlib.sha1(key.encode()).hexdigest() + '.npy'
+    return os.path.join(settings.SPECTRUM_CACHE_PATH, name)
+
+
+def load_spectrum(file, parser=parse_txt_spectrum):
+    if not settings.USE_SPECTRUM_CACHE:
+        return parser(file)
+
+    cache_file = cache_file_path(file)
+    try:
+        spectrum = np.load(cache_file, mmap_mode='r')
+        # the modification time of the entry is its last use
+        os.utime(cache_file)
+        return spectrum
+    except (OSError, ValueError):
+        # no cache entry yet (or a broken one)
+        pass
+
+    spectrum = parser(file)
+    try:
+        if not os.path.exists(settings.SPECTRUM_CACHE_PATH):
+            os.makedirs(settings.SPECTRUM_CACHE_PATH)
+        # write to a temporary file first, so other processes never see half of it
+        temporary_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+        with open(temporary_file, 'wb') as f:
+            np.save(f, spectrum)
+        os.replace(temporary_file, cache_file)
+        evict_entries()
+    except OSError as error:
+        print(f'{error}. The spectrum cache is not saved.')
+    return spectrum
+
+
+def evict_entries(max_size=None, max_age=None):
+    # remove the entries unused for max_age and then the least recently used
+    # ones until the cache is not bigger than max_size
+    max_size = settings.SPECTRUM_CACHE_MAX_SIZE if max_size is None else max_size
+    max_age = settings.SPECTRUM_CACHE_MAX_AGE if max_age is None else max_age
+    entries = []
+    for entry in os.scandir(settings.SPECTRUM_CACHE_PATH):
+        if entry.name.endswith('.npy'):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    entries.sort()
+    total_size = sum(size for _, size, _ in entries)
+    oldest_kept = time.time() - max_age
+    for mtime, size, path in entries:
+        if mtime >= oldest_kept and total_size <= max_size:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            # e.g. removed by another process meanwhile
+            pass
+        total_size -= size
+
+
+def clear_cache():
+    if not os.path.exists(settings.SPECTRUM_CACHE_PATH):
+        return
+    for name in os.listdir(settings.SPECTRUM_CACHE_PATH):
+        if name.endswith('.npy'):
+            os.remove(os.path.join(settings.SPECTRUM_CACHE_PATH, name))
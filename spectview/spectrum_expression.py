@@ -0,0 +1,225 @@
+import ast
+import weakref
+from collections import OrderedDict
+from numbers import Number
+
+import numpy as np
+
+from spectview.calibration import Calibration
+from spectview.datatypes import DataSet, GateInfo
+import spectview.settings as settings
+
+# evaluated expressions by the spectra (and their versions), coefficients and rebinning;
+# the spectra are weakly referenced, so the memo doesn't keep the closed spectra alive
+_evaluated = OrderedDict()
+
+
+def _drop_dead_entries():
+    # the entries of the spectra which don't exist anymore can't be hit again
+    for key in [key for key in _evaluated if any(term[0]() is None for term in key[1:])]:
+        del _evaluated[key]
+
+
+class ExpressionGate(GateInfo):
+    # named by the expression, e.g. gate_g1436g444-0.3*bg_g1436g444
+
+    def __init__(self, name):
+        super().__init__(filename=name)
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+
+class SpectrumExpression:
+    # lazy sum of the scaled spectra (DataSets), optionally rebinned: any expression
+    # of +, -, * (or /) by a number and rebin is kept as the coefficients of the spectra
+    # and one rebinning factor, so it is evaluated in one pass over every spectrum,
+    # together with its variance, and memoized until the spectra change
+
+    def __init__(self, terms, factor=1):
+        # {dataset: coefficient}
+        self.terms = terms
+        self.factor = factor
+
+    @classmethod
+    def of(cls, dataset):
+        return cls({dataset: 1.0})
+
+    def _combine(self, other, sign):
+        if isinstance(other, DataSet):
+            other = SpectrumExpression.of(other)
+        if not isinstance(other, SpectrumExpression):
+            return NotImplemented
+        if other.factor != self.factor:
+            raise ValueError(f'The spectra rebinned by {self.factor} and {other.factor} can\'t be added.')
+        terms = dict(self.terms)
+        for dataset, coefficient in other.terms.items():
+            terms[dataset] = terms.get(dataset, 0.0) + sign * coefficient
+        return type(self)(terms, self.factor)
+
+    def __add__(self, other):
+        return self._combine(other, 1.0)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        return self._combine(other, -1.0)
+
+    def __rsub__(self, other):
+        return (-self)._combine(other, 1.0)
+
+    def __mul__(self, number):
+        if not isinstance(number, Number):
+            return NotImplemented
+        return type(self)({dataset: number * c for dataset, c in self.terms.items()}, self.factor)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, number):
+        if not isinstance(number, Number):
+            return NotImplemented
+        return self * (1.0 / number)
+
+    def __neg__(self):
+        return self * -1.0
+
+    def rebin(self, factor):
+        # every `factor` bins summed (the last incomplete group is dropped)
+        if int(factor) != factor or factor < 1:
+            raise ValueError(f'Wrong rebinning factor: {factor}.')
+        return type(self)(dict(self.terms), self.factor * int(factor))
+
+    def __repr__(self):
+        name = ''
+        for dataset, coefficient in self.terms.items():
+            sign = '-' if coefficient < 0 else '+'
+            scale = '' if abs(coefficient) == 1 else f'{abs(coefficient):g}*'
+            name += f'{sign}{scale}{dataset.gate!r}'
+        name = name.lstrip('+')
+        if self.factor != 1:
+            name = f'rebin({name},{self.factor})'
+        return name
+
+    def _key(self):
+        return (self.factor,) + tuple(
+            (weakref.ref(dataset), dataset.version, coefficient) for dataset, coefficient in self.terms.items()
+        )
+
+    def _calibration(self):
+        calibrations = {
+            None if dataset.calibration is None else tuple(dataset.calibration.coefficients)
+            for dataset in self.terms
+        }
+        if len(calibrations) > 1:
+            raise ValueError(f'The spectra of {self} have different calibrations.')
+        calibration = next(iter(self.terms)).calibration
+        if self.factor == 1:
+            return calibration
+        # the rebinned spectra keep the x axis of the original bins
+        if calibration is None:
+            calibration = Calibration()
+        return calibration.rebinned(self.factor)
+
+    def evaluate(self, name=None):
+        # DataSet of the expression (with the variance), the same one until the spectra change
+        if not self.terms:
+            raise ValueError('Empty spectrum expression.')
+        key = self._key()
+        dataset = _evaluated.get(key)
+        if dataset is not None:
+            _evaluated.move_to_end(key)
+            return dataset
+
+        n_bins = {len(dataset.spectrum) for dataset in self.terms}
+        if len(n_bins) > 1:
+            raise ValueError(f'The spectra of {self} have different numbers of bins.')
+        n_bins = n_bins.pop()
+
+        # one accumulation pass per spectrum, without the temporary arrays of the operators
+        values = np.zeros(n_bins)
+        variance = np.zeros(n_bins)
+        buffer = np.empty(n_bins)
+        for term, coefficient in self.terms.items():
+            np.multiply(term.spectrum, coefficient, out=buffer)
+            values += buffer
+            if term.variance is None:
+                np.maximum(term.spectrum, 0, out=buffer)
+            else:
+                buffer[:] = term.variance
+            buffer *= coefficient**2
+            variance += buffer
+
+        if self.factor != 1:
+            n_groups = n_bins // self.factor
+            values = values[:n_groups * self.factor].reshape(n_groups, self.factor).sum(axis=1)
+            variance = variance[:n_groups * self.factor].reshape(n_groups, self.factor).sum(axis=1)
+        values.setflags(write=False)
+        variance.setflags(write=False)
+
+        dataset = DataSet(
+            spectrum=values, gate=ExpressionGate(name or repr(self)),
+            calibration=self._calibration(), variance=variance
+        )
+        _drop_dead_entries()
+        _evaluated[key] = dataset
+        while len(_evaluated) > settings.EXPRESSION_CACHE_SIZE:
+            _evaluated.popitem(last=False)
+        return dataset
+
+
+def rebin(expression, factor):
+    if isinstance(expression, DataSet):
+        expression = SpectrumExpression.of(expression)
+    if not isinstance(expression, SpectrumExpression):
+        raise ValueError(f'{expression} is not a spectrum.')
+    return expression.rebin(factor)
+
+
+# the only syntax of the expressions: numbers, names, + - * / and rebin(spectrum, factor)
+_ALLOWED_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Add, ast.Sub, ast.Mult, ast.Div,
+    ast.UAdd, ast.USub, ast.Constant, ast.Name, ast.Load, ast.Call
+)
+
+
+def _check_syntax(tree, names):
+    nodes = list(ast.walk(tree))
+    functions = {id(node.func) for node in nodes if isinstance(node, ast.Call)}
+    for node in nodes:
+        if not isinstance(node, _ALLOWED_NODES):
+            raise ValueError(f'Not allowed in the expressions: {ast.unparse(node) or type(node).__name__}.')
+        if isinstance(node, ast.Constant) and (
+            isinstance(node.value, bool) or not isinstance(node.value, (int, float))
+        ):
+            raise ValueError(f'Not a number: {node.value!r}.')
+        if isinstance(node, ast.Call) and (
+            not isinstance(node.func, ast.Name) or node.func.id != 'rebin'
+            or node.keywords or len(node.args) != 2
+        ):
+            raise ValueError(f'Only rebin(spectrum, factor) can be called: {ast.unparse(node)}.')
+        if isinstance(node, ast.Name) and id(node) not in functions and node.id not in names:
+            raise ValueError(f'Unknown spectrum: {node.id}.')
+
+
+def parse_expression(text, datasets):
+    # e.g. 'gate_g1436g444 - 0.3*bg_g1436g444' or 'rebin(gate_g1436g444 + gate_g1436g539, 2)'
+    # with the spectra by their names; only the numbers, the names and rebin are allowed
+    # (the syntax tree is checked before it is evaluated)
+    try:
+        tree = ast.parse(text.strip(), mode='eval')
+    except (SyntaxError, RecursionError) as error:
+        raise ValueError(f'Wrong expression: {text}.') from error
+    _check_syntax(tree, datasets)
+
+    namespace = {'rebin': rebin}
+    namespace.update((name, SpectrumExpression.of(dataset)) for name, dataset in datasets.items())
+    try:
+        expression = eval(compile(tree, '<expression>', 'eval'), {'__builtins__': {}}, namespace)
+    except RecursionError as error:
+        raise ValueError(f'Wrong expression: {text}.') from error
+    if isinstance(expression, DataSet):
+        expression = SpectrumExpression.of(expression)
+    if not isinstance(expression, SpectrumExpression):
+        raise ValueError(f'{text} is not a spectrum.')
+    return expression
@@ -1,13 +1,21 @@
 import os
-import tkinter as tk
-from tkinter import filedialog
+from functools import partial
 
+import numpy as np
 import matplotlib.pyplot as plt
-from matplotlib.widgets import Button, TextBox, RadioButtons
-
-from spectview.plot_utils import ClickCatcher, SpectrumSelector, PeakCatcher, PlotManager
-from spectview.datatypes import DataSet
-from spectview.peak_fitter import PeakFitter, Peak
+from matplotlib.widgets import Button, RadioButtons
+
+from spectview.plot_utils import (
+    BlitManager, ClickCatcher, LazyTextBox, SpectrumSelector, PeakCatcher, PlotManager
+)
+from spectview.calibration import Calibration
+from spectview.datatypes import DataSet, Peak
+from spectview.catalog import SpectrumCatalog, parse_query
+from spectview.dataset_store import dataset_store
+from spectview.fit_worker import BootstrapJob, FitJob, FitWorker
+from spectview.instrumentation import ActionTimer
+from spectview.results_store import ResultsStore, fit_rows
+from spectview.spectrum_expression import parse_expression
 import spectview.settings as settings
 
 
@@ -18,7 +26,7 @@ class Window:
     RADIO_BUTTONS = settings.RADIO_BUTTONS
     KEYMAP = settings.KEYMAP
 
-    def __init__(self):
+    def __init__(self, show=True):
         self.bins = settings.SPECTRUM_BINS
         self.is_autoscale_on = False
         self.is_click_catcher_working = False
@@ -26,8 +34,25 @@ class Window:
         self.fit_click = None
         self.click_data_for_fit = None
         self.peak_fit = None
+        # name of the spectrum of the last fit
+        self.peak_fit_gate_name = None
+        # plotted spectra names to their datasets and files
+        self.datasets = {}
+        self.dataset_files = {}
+        # live spectra of the list mode files and their refresh timers
+        self.live_spectra = {}
+        # spectra files found with the 'Find' box
+        self.catalog = None
+        # background fits, the worker thread is started with the first fit
+        self.fit_worker = None
+        self._fit_timer = None
+        # timing of the user actions, only when it is switched on
+        self.action_timer = (
+            ActionTimer(window_size=settings.ACTION_TIMING_WINDOW) if settings.ACTION_TIMING else None
+        )
 
         self.fig, self.ax = plt.subplots()
+        self.blit_manager = BlitManager(self.fig.canvas)
         self.configure_appearance()
         self.configure_behaviour()
 
@@ -36,6 +61,7 @@ class Window:
         self._add_check_buttons()
         self._add_text_frames()
         self.fig.canvas.mpl_connect('key_press_event', self._key_press)
+        self.fig.canvas.mpl_connect('close_event', self._close)
 
         self.selection = SpectrumSelector(self)
         self.spect_plot_manager = PlotManager(self)
@@ -49,8 +75,13 @@ class Window:
         self.gate_name_box = plt.gcf().text(
             s=self.gate_name, **settings.GATE_NAME_BOX_SETUP
         )
+        self.blit_manager.add_artist(self.gate_name_box)
 
-        plt.show()
+        self.fit_status_box = plt.gcf().text(s='', **settings.FIT_STATUS_BOX_SETUP)
+        self.blit_manager.add_artist(self.fit_status_box)
+
+        if show:
+            plt.show()
 
     @classmethod
     def add_new_window(cls, event):
@@ -74,6 +105,9 @@ class Window:
 
     @selected_spectrum.setter
     def selected_spectrum(self, value):
+        self.select_spectrum(value)
+
+    def select_spectrum(self, value, full_redraw=True):
         self._selected_spectrum = value
 
         # setting current spectrum name (self.gaten_name)
@@ -84,7 +118,11 @@ class Window:
                 self.gate_name = self.fit_plot_manager.line2d_to_name[value.__repr__()]
         else:
             self.gate_name = ''
-        self._update_plot()
+
+        if full_redraw:
+            self._update_plot()
+        else:
+            self._update_overlay()
 
     def catch_coordinates(self):
         click = ClickCatcher(self)
@@ -102,6 +140,9 @@ class Window:
         self.click_data_for_fit = self.fit_click.get_data()
 
     def do_fit(self, event):
+        # lmfit is imported with the first fit, not at the start up
+        from spectview.peak_fitter import PeakFitter
+
         # read selected main points for fit
         try:
             fit_peaks = [
@@ -111,35 +152,183 @@ class Window:
                 )
             ]
 
-            # read fit x range
-            fit_range = [
-                int(self.click_data_for_fit[0][0]),
-                int(self.click_data_for_fit[0][-1])
-            ]
-
-            # read data for fit in selected range
-            data_x, data_y = self.selected_spectrum.get_data()
+            # read data for fit in selected x range (bins or energy)
+            data_x, data_y = self.spect_plot_manager.get_data(self.selected_spectrum)
+            fit_range = np.searchsorted(
+                data_x, [self.click_data_for_fit[0][0], self.click_data_for_fit[0][-1]]
+            ).tolist()
             data_x = data_x[slice(*fit_range)]
             data_y = data_y[slice(*fit_range)]
 
-            # calculate fit
-            self.peak_fit = PeakFitter(data_x=data_x, data_y=data_y, peaks=fit_peaks)
-            self.peak_fit.do_fit(verbosity=settings.FIT_VERBOSITY)
-            result_x, result_y = self.peak_fit.get_result()
+            # the selected line can also be e.g. a fit curve, which has no dataset
+            dataset = self.datasets.get(self.gate_name)
 
-            # plot fit result
-            self.fit_plot_manager.add_plot(
-                f'fit_{PeakFitter.ith_fit}_{self.gate_name}', result_x, result_y
+            # fixed SNIP background when it is switched on or shown for the spectrum
+            background = None
+            is_background_shown = self._background_name() in self.fit_plot_manager.name_to_line2d
+            if dataset is not None and (settings.FIT_BACKGROUND == 'snip' or is_background_shown):
+                background = dataset.get_background(slicing=fit_range)
+
+            # the derived spectra (e.g. gate - k*bg) are fitted with their errors
+            sigma = None
+            if dataset is not None and dataset.variance is not None:
+                sigma = dataset.get_sigma(slicing=fit_range)
+
+            # calculate fit
+            peak_fit = PeakFitter(
+                data_x=data_x, data_y=data_y, peaks=fit_peaks, background=background,
+                fwhm_calibration=settings.FWHM_CALIBRATION, free_width_scale=settings.FIT_FREE_WIDTH_SCALE,
+                sigma=sigma
             )
+            name = f'fit_{peak_fit.number}_{self.gate_name}'
 
             # disconnect catching points for fit
             self.fit_click.disconnect()
 
-            self._update_plot()
+            if settings.FIT_IN_BACKGROUND:
+                self._submit_fit(FitJob(peak_fit, name, self.gate_name))
+            else:
+                peak_fit.do_fit(verbosity=settings.FIT_VERBOSITY)
+                if self.action_timer is not None:
+                    self.action_timer.record_fit(peak_fit.result.nfev)
+                self._show_fit(peak_fit, name, self.gate_name)
 
         except (TypeError, ValueError, AttributeError, IndexError):
             print('No data for fit.')
 
+    def do_global_fit(self, event):
+        # the region marked for the fit in all plotted spectra at once,
+        # the centroids and widths of the peaks are shared by the spectra
+        from spectview.global_fitter import GlobalPeakFitter
+
+        try:
+            fit_peaks = [
+                Peak(cen, amp) for cen, amp in zip(
+                    self.click_data_for_fit[0][1:-1],
+                    self.click_data_for_fit[1][1:-1]
+                )
+            ]
+            names = list(self.spect_plot_manager.name_to_line2d)
+            spectra, backgrounds, sigmas = [], [], []
+            for name in names:
+                data_x, data_y = self.spect_plot_manager.get_data(self.spect_plot_manager.name_to_line2d[name])
+                fit_range = np.searchsorted(
+                    data_x, [self.click_data_for_fit[0][0], self.click_data_for_fit[0][-1]]
+                ).tolist()
+                spectra.append((data_x[slice(*fit_range)], data_y[slice(*fit_range)]))
+                sigmas.append(self.datasets[name].get_sigma(slicing=fit_range))
+
+                is_background_shown = f'snip_{name}' in self.fit_plot_manager.name_to_line2d
+                if settings.FIT_BACKGROUND == 'snip' or is_background_shown:
+                    backgrounds.append(self.datasets[name].get_background(slicing=fit_range))
+                else:
+                    backgrounds.append(None)
+
+            # all the spectra are weighted when one of them is derived (e.g. gate - k*bg)
+            if all(self.datasets[name].variance is None for name in names):
+                sigmas = None
+            global_fit = GlobalPeakFitter(spectra, fit_peaks, backgrounds=backgrounds, sigmas=sigmas, names=names)
+
+            # disconnect catching points for fit
+            self.fit_click.disconnect()
+
+            if settings.FIT_IN_BACKGROUND:
+                self._submit_fit(FitJob(global_fit, f'global_fit_{global_fit.number}', self.gate_name))
+            else:
+                global_fit.do_fit(verbosity=settings.FIT_VERBOSITY)
+                if self.action_timer is not None:
+                    self.action_timer.record_fit(global_fit.result.nfev)
+                self._show_global_fit(global_fit)
+
+        except (TypeError, ValueError, AttributeError, IndexError, KeyError, np.linalg.LinAlgError):
+            print('No data for fit.')
+
+    def _show_fit(self, peak_fit, name, gate_name):
+        self.peak_fit = peak_fit
+        self.peak_fit_gate_name = gate_name
+        result_x, result_y = peak_fit.get_result()
+
+        # plot fit result
+        self.fit_plot_manager.add_plot(name, result_x, result_y)
+        self._update_plot()
+
+    def _show_global_fit(self, global_fit):
+        for spectrum_fit in global_fit.spectrum_fits:
+            if spectrum_fit.name not in self.datasets:
+                # the spectrum was removed during the fit
+                continue
+            self.fit_plot_manager.add_plot(
+                f'global_fit_{global_fit.number}_{spectrum_fit.name}', *spectrum_fit.get_result()
+            )
+            if spectrum_fit.name == self.gate_name:
+                self.peak_fit = spectrum_fit
+                self.peak_fit_gate_name = spectrum_fit.name
+        self._update_plot()
+
+    def _show_job(self, job):
+        if hasattr(job.peak_fit, 'spectrum_fits'):
+            self._show_global_fit(job.peak_fit)
+        else:
+            self._show_fit(job.peak_fit, job.name, job.gate_name)
+
+    def _submit_fit(self, job):
+        if self.fit_worker is None:
+            self.fit_worker = FitWorker(verbosity=settings.FIT_VERBOSITY)
+        self.fit_worker.submit(job)
+
+        # the finished fits are plotted by the GUI thread
+        if self._fit_timer is None:
+            self._fit_timer = self.fig.canvas.new_timer(interval=settings.FIT_POLL_INTERVAL)
+            self._fit_timer.add_callback(self._poll_fits)
+            self._fit_timer.start()
+        self._update_fit_status()
+
+    def _poll_fits(self):
+        for job in self.fit_worker.get_finished():
+            if job.error is not None:
+                print(f'Fit {job.name} failed: {job.error}')
+            elif job.is_cancelled or job.peak_fit.result is None or job.peak_fit.result.aborted:
+                print(f'Fit {job.name} cancelled.')
+            elif isinstance(job, BootstrapJob):
+                self._save_bootstrap_report(job.bootstrap_result, job.gate_name)
+            elif not hasattr(job.peak_fit, 'spectrum_fits') and job.gate_name not in self.datasets:
+                # the spectrum was removed during the fit
+                print(f'Fit {job.name} dropped, its spectrum is not plotted anymore.')
+            elif self.action_timer is None:
+                self._show_job(job)
+            else:
+                # the timer runs outside of the user actions, the finished fit is
+                # recorded as its own action (its evaluations and the plotting)
+                with self.action_timer.action('background_fit'):
+                    self.action_timer.record_fit(job.peak_fit.result.nfev)
+                    self._show_job(job)
+
+        if not self.fit_worker.jobs:
+            self._fit_timer.stop()
+            self._fit_timer = None
+        self._update_fit_status()
+
+    def _update_fit_status(self):
+        jobs = self.fit_worker.jobs if self.fit_worker is not None else []
+        if jobs:
+            status = f'{jobs[0].name}: {jobs[0].status}'
+            if len(jobs) > 1:
+                status += f', {len(jobs) - 1} queued'
+        else:
+            status = ''
+        if status != self.fit_status_box.get_text():
+            # only the status box is redrawn, not the whole figure
+            self.fit_status_box.set_text(status)
+            self.blit_manager.update()
+
+    def cancel_fits(self, event):
+        jobs = self.fit_worker.jobs if self.fit_worker is not None else []
+        if not jobs:
+            print('No fits running.')
+            return
+        self.fit_worker.cancel_all()
+        print(f'{len(jobs)} fits cancelled.')
+
     def activate_marking_for_fit(self, event):
         if self.is_click_catcher_working:
             pass
@@ -162,6 +351,52 @@ class Window:
 
         print(f'The fit report saved to the {file} file.')
 
+        if settings.RESULTS_DATABASE:
+            # all spectra of the global fit
+            if hasattr(self.peak_fit, 'global_fit'):
+                peak_fits = self.peak_fit.global_fit.spectrum_fits
+            else:
+                peak_fits = [self.peak_fit]
+            rows = [
+                row for peak_fit in peak_fits for row in fit_rows(
+                    peak_fit, gate=getattr(peak_fit, 'name', self.gate_name),
+                    file=self.dataset_files.get(getattr(peak_fit, 'name', self.gate_name)),
+                    range_low=float(peak_fit.data_x[0]), range_high=float(peak_fit.data_x[-1])
+                )
+            ]
+            with ResultsStore() as store:
+                store.add_fits(rows)
+            print(f'{len(rows)} peaks saved to the {settings.RESULTS_DATABASE} database.')
+
+    def bootstrap_fit(self, event):
+        # percentile intervals of the last fit from the fits of the Poisson resampled spectrum
+        from spectview.bootstrap import bootstrap
+
+        if self.peak_fit is None or self.peak_fit.result is None:
+            print('There isn\'t any fit.')
+            return
+        if hasattr(self.peak_fit, 'global_fit'):
+            print('The bootstrap of the global fits is not supported.')
+            return
+
+        if settings.FIT_IN_BACKGROUND:
+            name = f'bootstrap_{self.peak_fit.number}_{self.gate_name}'
+            self._submit_fit(BootstrapJob(self.peak_fit, name, self.gate_name))
+        else:
+            self._save_bootstrap_report(bootstrap(self.peak_fit), self.gate_name)
+
+    def _save_bootstrap_report(self, bootstrap_result, gate_name):
+        report = bootstrap_result.generate_report()
+        print(report)
+
+        gate_name = gate_name.replace(' ', '')
+        file = os.path.join(settings.OUTPUT_FIT_RESULTS_PATH, f'fit_results_{gate_name}.txt')
+        if not os.path.exists(settings.OUTPUT_FIT_RESULTS_PATH):
+            os.makedirs(settings.OUTPUT_FIT_RESULTS_PATH)
+        with open(file, 'a') as f:
+            f.write(report)
+        print(f'The bootstrap intervals saved to the {file} file.')
+
     def print_marked_points(self, event):
         try:
             result = self.get_clicked_points()
@@ -179,6 +414,10 @@ class Window:
 
             print(f'The marked points saved to the {file} file.')
 
+            if settings.RESULTS_DATABASE:
+                with ResultsStore() as store:
+                    store.add_marked_points(self.gate_name, zip(*self.click_data))
+
         except (TypeError, AttributeError):
             # when no data was selected
             print('There aren\'t any marked points.')
@@ -196,7 +435,7 @@ class Window:
 
     def configure_appearance(self):
         plt.subplots_adjust(**settings.WINDOW_SETUP)
-        self.fig.canvas.set_window_title('Spectview')
+        self.fig.canvas.manager.set_window_title('Spectview')
         self.fig.set_size_inches(*settings.FIGURE_SIZE)
         self.ax.tick_params(axis='both', labelsize=settings.LABELS_SIZE)
         self.ax.set_ylabel('Number of counts', fontsize=settings.LABELS_SIZE)
@@ -205,20 +444,40 @@ class Window:
     def _update_plot(self):
         if self.is_autoscale_on:
             self._y_axis_autoscale()
-        plt.draw()
+        self._draw()
+
+    def _draw(self):
+        if self.action_timer is None:
+            plt.draw()
+        else:
+            # synchronous draw, so its time is counted to the action
+            with self.action_timer.draw():
+                self.fig.canvas.draw()
+
+    def _update_overlay(self):
+        # redraw only the animated artists (marked points, highlighted spectrum,
+        # gate name) over the cached background
+        if self.is_autoscale_on:
+            self._update_plot()
+        elif self.action_timer is None:
+            self.blit_manager.update()
+        else:
+            with self.action_timer.draw():
+                self.blit_manager.update()
 
     @staticmethod
     def load_data_from_file(filename):
-        if filename.endswith('.txt'):
-            return DataSet.from_txt(file=filename)
-        elif filename.endswith('.h5'):
-            return DataSet.from_hdf5(file=filename)
-        else:
+        if not filename.endswith(('.txt', '.h5')):
             print('Wrong data file extension.')
             return None
+        return DataSet.from_file(filename)
 
     @staticmethod
     def open_file_dialog():
+        # tkinter is imported with the first file dialog, not at the start up
+        import tkinter as tk
+        from tkinter import filedialog
+
         root = tk.Tk()
         root.withdraw()
         file_path = filedialog.askopenfilename(filetypes=settings.DATA_FILETYPES)
@@ -229,17 +488,146 @@ class Window:
         file_path = Window.open_file_dialog()
 
         if file_path:
-            dataset = Window.load_data_from_file(filename=file_path)
-            line2d = self.spect_plot_manager.add_plot(
-                name=dataset.gate.__repr__(),
-                data_x=dataset.get_spectrum()[0],
-                data_y=dataset.get_spectrum()[1]
-            )
+            self.add_dataset_from_file(file_path)
 
-            # auto-select the new spectrum
-            self.selected_spectrum = line2d
-            self.ax.relim()
-            self._update_plot()
+    def add_dataset_from_file(self, file_path):
+        # the spectrum is shared with other windows which have opened the same file
+        dataset = dataset_store.acquire(file_path, owner=self, loader=Window.load_data_from_file)
+        if dataset is None:
+            return None
+
+        line2d = self.add_dataset(dataset)
+        if line2d is None:
+            if dataset.gate.__repr__() not in self.dataset_files:
+                dataset_store.release(file_path, owner=self)
+            return None
+
+        self.dataset_files[dataset.gate.__repr__()] = file_path
+        return line2d
+
+    def add_datasets_from_files(self, file_paths):
+        # the files are loaded in parallel by the catalog first, then the window
+        # owns them and the catalog releases them
+        if self.catalog is None:
+            return [self.add_dataset_from_file(file_path) for file_path in file_paths]
+        self.catalog.load(file_paths)
+        lines = [self.add_dataset_from_file(file_path) for file_path in file_paths]
+        self.catalog.release(file_paths)
+        return lines
+
+    def find_spectra(self, text):
+        # e.g. 'gate 1436 444' or 'bg 539'
+        if not text.strip():
+            return
+        try:
+            gammas, type_ = parse_query(text)
+        except ValueError:
+            print(f'Wrong query: {text}. Use e.g. gate 1436 444 or bg 539.')
+            return
+
+        if self.catalog is None:
+            self.catalog = SpectrumCatalog(settings.CATALOG_DIRECTORY)
+        files = self.catalog.find(gammas, type_=type_)
+        print(f'{len(files)} of {len(self.catalog)} spectra found.')
+        if len(files) > settings.CATALOG_MAX_PLOTTED:
+            print(f'Only the first {settings.CATALOG_MAX_PLOTTED} are plotted.')
+        self.add_datasets_from_files(files[:settings.CATALOG_MAX_PLOTTED])
+
+    def add_expression(self, text):
+        # e.g. gate_g1436g444 - 0.3*bg_g1436g444 or rebin(gate_g1436g444 + gate_g1436g539, 2)
+        # of the plotted spectra
+        if not text.strip():
+            return
+        try:
+            dataset = parse_expression(text, self.datasets).evaluate()
+        except (ValueError, TypeError, ZeroDivisionError, OverflowError) as error:
+            print(f'Wrong expression: {error}')
+            return
+        self.add_dataset(dataset)
+
+    def add_dataset(self, dataset):
+        name = dataset.gate.__repr__()
+        line2d = self.spect_plot_manager.add_plot(
+            name=name,
+            data_x=dataset.get_spectrum()[0],
+            data_y=dataset.get_spectrum()[1]
+        )
+        if line2d is None:
+            return None
+        self.datasets[name] = dataset
+        if dataset.calibration is not None:
+            self.ax.set_xlabel('Energy [keV]', fontsize=settings.LABELS_SIZE)
+
+        # auto-select the new spectrum
+        self.selected_spectrum = line2d
+        self.ax.relim()
+        self._update_plot()
+        return line2d
+
+    def watch_list_mode(self, file_path, n_bins=None):
+        # the spectrum grows with the list mode file, new events are read on every timer tick
+        from spectview.list_mode import LiveSpectrum
+
+        live_spectrum = LiveSpectrum(file_path, n_bins=n_bins)
+        live_spectrum.update()
+        line2d = self.add_dataset(live_spectrum.dataset)
+        if line2d is None:
+            return None
+
+        timer = self.fig.canvas.new_timer(interval=settings.LIVE_REFRESH_INTERVAL)
+        timer.add_callback(self._refresh_live_spectrum, live_spectrum.dataset.gate.__repr__())
+        timer.start()
+        self.live_spectra[live_spectrum.dataset.gate.__repr__()] = (live_spectrum, timer)
+        return line2d
+
+    def _refresh_live_spectrum(self, name):
+        live_spectrum, _ = self.live_spectra[name]
+        if not live_spectrum.update():
+            return
+        # the plotted dataset shares the spectrum, but can be calibrated meanwhile
+        self.spect_plot_manager.update_plot(name, *self.datasets[name].get_spectrum())
+        self._update_plot()
+
+    def _stop_live_spectrum(self, name):
+        if name in self.live_spectra:
+            _, timer = self.live_spectra.pop(name)
+            timer.stop()
+
+    def _background_name(self):
+        return f'snip_{self.gate_name}'
+
+    def show_background(self, event):
+        # toggle the SNIP background of the selected spectrum
+        name = self._background_name()
+        if name in self.fit_plot_manager.name_to_line2d:
+            self.fit_plot_manager.remove_plot(name)
+        elif self.gate_name in self.datasets:
+            dataset = self.datasets[self.gate_name]
+            self.fit_plot_manager.add_plot(name, dataset.get_spectrum()[0], dataset.get_background())
+        else:
+            print('Select a spectrum to show its background.')
+            return
+        self._update_plot()
+
+    def _forget_dataset(self, name):
+        self._stop_live_spectrum(name)
+        self.datasets.pop(name, None)
+        file_path = self.dataset_files.pop(name, None)
+        if file_path:
+            dataset_store.release(file_path, owner=self)
+
+    def _close(self, event):
+        if self.fit_worker is not None:
+            self.fit_worker.cancel_all()
+        if self._fit_timer is not None:
+            self._fit_timer.stop()
+        if self.catalog is not None:
+            self.catalog.close()
+        for name in list(self.live_spectra):
+            self._stop_live_spectrum(name)
+        self.datasets.clear()
+        self.dataset_files.clear()
+        dataset_store.release_all(self)
 
     def auto_select_next_plot(self):
         # auto-select another spectrum if there still is another plot
@@ -254,6 +642,7 @@ class Window:
         try:
             # remove selected spectrum plot
             self.spect_plot_manager.remove_plot(self.gate_name)
+            self._forget_dataset(self.gate_name)
 
             # clear fit plots which belong to removed spectrum
             for name in self.fit_plot_manager.line2d_to_name.values():
@@ -284,6 +673,66 @@ class Window:
         self._y_axis_autoscale()
         self._update_plot()
 
+    def calibrate(self, text):
+        # text is a calibration file or the energies of the last fitted (or marked) peaks
+        text = text.strip()
+        if not text:
+            return
+        try:
+            dataset = self.datasets[self.gate_name]
+        except KeyError:
+            print('Select a spectrum to calibrate.')
+            return
+
+        try:
+            if os.path.isfile(text):
+                calibration = Calibration.from_file(text)
+            else:
+                energies = sorted(float(energy) for energy in text.replace(',', ' ').split())
+                # the fit of another spectrum would give a wrong calibration
+                is_fitted = (
+                    self.peak_fit is not None and self.peak_fit.result is not None
+                    and self.peak_fit_gate_name == self.gate_name
+                )
+                if is_fitted:
+                    positions = [peak['centroid'] for peak in self.peak_fit.get_peaks_parameters()]
+                elif self.click_data is not None:
+                    positions = self.click_data[0]
+                else:
+                    print(f'Fit or mark the peaks of {self.gate_name} first.')
+                    return
+                # the positions are in the current x units of the spectrum
+                bins = dataset.energy_to_bin(sorted(positions))
+                calibration = Calibration.from_peaks(bins, energies)
+        except (TypeError, ValueError, OSError) as error:
+            print(f'Calibration failed: {error}')
+            return
+
+        # x limits are kept on the same bins
+        view_bins = dataset.energy_to_bin(self.ax.get_xlim())
+        self._replace_dataset(dataset.calibrated(calibration))
+        self.ax.set_xlim(*calibration.bin_to_energy(view_bins))
+        self._update_plot()
+
+        file_path = self.dataset_files.get(self.gate_name)
+        if file_path:
+            calibration_file = os.path.splitext(file_path)[0] + '.cal'
+            calibration.save(calibration_file)
+            print(f'{calibration} saved to the {calibration_file} file.')
+        else:
+            print(f'{calibration} set.')
+
+    def _replace_dataset(self, dataset):
+        # replot the spectrum (e.g. in new x units), its fits are not valid anymore
+        name = dataset.gate.__repr__()
+        self.spect_plot_manager.remove_plot(name)
+        for fit_name in list(self.fit_plot_manager.line2d_to_name.values()):
+            if fit_name.endswith(name):
+                self.fit_plot_manager.remove_plot(fit_name)
+        self.peak_fit = None
+        self.peak_fit_gate_name = None
+        self.add_dataset(dataset)
+
     def save_svg(self, event):
         filename = "{}_{}-{}.svg".format(
             self.gate_name.replace(' ', ''),
@@ -294,9 +743,10 @@ class Window:
             os.makedirs(settings.OUTPUT_FIGURES_PATH)
 
 
-        plt.savefig(
-            os.path.join(settings.OUTPUT_FIGURES_PATH, filename)
-        )
+        with self.blit_manager.static_artists():
+            plt.savefig(
+                os.path.join(settings.OUTPUT_FIGURES_PATH, filename)
+            )
 
         print('File {} saved.'.format(filename))
 
@@ -320,10 +770,22 @@ class Window:
     def _y_axis_autoscale(self):
         try:
             x1, x2 = self.ax.get_xlim()
-            x1, x2 = max(0, x1), min(x2, self.bins)
-            data_y = self.selected_spectrum.get_data(orig=True)[1]
-            spect_slice = data_y[int(x1): int(x2)]
-            self.ax.set_ylim(0, 1.2 * max(spect_slice))
+            if settings.AUTOSCALE_ALL_LINES:
+                lines = self.ax.lines
+            elif self.selected_spectrum is None:
+                raise AttributeError('No spectrum selected')
+            else:
+                lines = [self.selected_spectrum]
+
+            maxima = [
+                plot_manager.get_max(line, x1, x2)
+                for plot_manager in (self.spect_plot_manager, self.fit_plot_manager)
+                for line in lines
+            ]
+            maxima = [y_max for y_max in maxima if y_max is not None]
+            if not maxima:
+                raise ValueError('No data in the view')
+            self.ax.set_ylim(0, 1.2 * max(maxima))
 
         except (ValueError, AttributeError) as error:
             print(f'{error}. You can\'t use autoscale now.')
@@ -331,13 +793,26 @@ class Window:
 
     def show_all(self, event):
         try:
-            x1, *_, x2 = self.selected_spectrum.get_data(orig=True)[0]
+            x1, *_, x2 = self.spect_plot_manager.get_data(self.selected_spectrum)[0]
             self.ax.set_xlim(x1, x2)
             self._y_axis_autoscale()
         except AttributeError:
             # if there is no spectrum just do nothing
             pass
 
+    def print_action_timing(self, event):
+        if self.action_timer is None:
+            print('Action timing is off. Set ACTION_TIMING = True in the settings.')
+            return
+
+        if not os.path.exists(settings.OUTPUT_TIMING_PATH):
+            os.makedirs(settings.OUTPUT_TIMING_PATH)
+        file = os.path.join(settings.OUTPUT_TIMING_PATH, 'action_timing.json')
+        self.action_timer.dump(file)
+
+        print(self.action_timer.report())
+        print(f'The action timing saved to the {file} file.')
+
     @staticmethod
     def do_nothing(event):
         print('Nothing done!')
@@ -402,25 +877,40 @@ class Window:
         for key, item in Window.BUTTONS_DICT.items():
             button_name = 'button_{}'.format(key)
             setattr(self, button_name, Button(plt.axes(item[0]), item[1]))
-            getattr(self, button_name).on_clicked(getattr(self, item[2]))
+            getattr(self, button_name).on_clicked(partial(self._dispatch, item[2]))
             getattr(self, button_name).label.set_fontsize(settings.BUTTONS_FONTSIZE)
 
     def _add_text_boxes(self):
         for key, item in Window.TEXT_BOXES_DICT.items():
             tbox_name = 'tbox_{}'.format(key)
-            setattr(self, tbox_name, TextBox(plt.axes(item[0]), item[1], '', label_pad=item[2]))
-            getattr(self, tbox_name).on_submit(getattr(self, item[3]))
+            setattr(self, tbox_name, LazyTextBox(plt.axes(item[0]), item[1], '', label_pad=item[2]))
+            getattr(self, tbox_name).on_submit(partial(self._dispatch, item[3]))
 
     def _add_check_buttons(self):
         for key, item in Window.RADIO_BUTTONS.items():
             rbutton_name = 'rbutton_name_{}'.format(key)
             setattr(self, rbutton_name, RadioButtons(plt.axes(item[0]), item[1]))
-            getattr(self, rbutton_name).on_clicked(getattr(self, item[2]))
+            getattr(self, rbutton_name).on_clicked(partial(self._dispatch, item[2]))
+
+    def _is_typing(self):
+        return any(getattr(self, f'tbox_{key}').capturekeystrokes for key in Window.TEXT_BOXES_DICT)
 
     def _key_press(self, event):
+        # the keys typed into a text box are not the shortcuts (matplotlib's TextBox
+        # only clears its own keymaps)
+        if self._is_typing():
+            return
         for key, _function in Window.KEYMAP.items():
             if event.key == key:
-                getattr(self, _function)(event)
+                self._dispatch(_function, event)
+
+    def _dispatch(self, function_name, *args):
+        # every key, button and text box action goes through here
+        function = getattr(self, function_name)
+        if self.action_timer is None:
+            return function(*args)
+        with self.action_timer.action(function_name):
+            return function(*args)
 
     def _add_text_frames(self):
         # plt.gcf() let us use figure coordinates instead of axis coordinates
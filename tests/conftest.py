@@ -0,0 +1,8 @@
+import os
+import sys
+
+import matplotlib
+
+# the windows are created without a display
+matplotlib.use('Agg')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+import spectview.settings as settings
+from spectview.list_mode import LiveSpectrum, histogram_file, histogram_matrix, synthetic_events
+
+N_BINS = 256
+
+
+@pytest.fixture
+def events_file(tmp_path):
+    events = synthetic_events(20000, N_BINS + 10, 0, np.random.RandomState(0))
+    file = str(tmp_path / 'run.bin')
+    events.tofile(file)
+    return file, events
+
+
+def reference_histogram(events, energy_cut=None, time_cut=None):
+    energies = events[settings.LIST_MODE_ENERGY_FIELD].astype(int)
+    # np.histogram closes the last bin, the channels past the spectrum are dropped
+    mask = energies < N_BINS
+    if energy_cut is not None:
+        mask &= (energies >= energy_cut[0]) & (energies <= energy_cut[1])
+    if time_cut is not None:
+        mask &= (events['time'] >= time_cut[0]) & (events['time'] <= time_cut[1])
+    return np.histogram(energies[mask], bins=N_BINS, range=(0, N_BINS))[0]
+
+
+def reference_matrix(events):
+    # every pair of records closer than the coincidence window (up to the maximum lag)
+    energies = events[settings.LIST_MODE_ENERGY_FIELD].astype(int)
+    times = events['time'].astype(np.int64)
+    matrix = np.zeros((N_BINS, N_BINS), dtype=np.int64)
+    for i in range(len(events)):
+        for j in range(i + 1, min(i + settings.COINCIDENCE_MAX_LAG + 1, len(events))):
+            if (times[j] - times[i] <= settings.COINCIDENCE_WINDOW
+                    and energies[i] < N_BINS and energies[j] < N_BINS
+                    and events['detector'][i] != events['detector'][j]):
+                matrix[energies[i], energies[j]] += 1
+                matrix[energies[j], energies[i]] += 1
+    return matrix
+
+
+def test_live_spectrum(events_file, tmp_path):
+    _, events = events_file
+    file = str(tmp_path / 'live.bin')
+    live = LiveSpectrum(file, n_bins=N_BINS)
+    data = events.tobytes()
+    # the last record of a piece can be written only partly
+    for start, stop in ((0, 1000), (1000, 5555), (5555, 5556), (5556, len(data) - 7), (len(data) - 7, len(data))):
+        with open(file, 'ab') as f:
+            f.write(data[start:stop])
+        live.update()
+        n_complete = stop // events.itemsize
+        np.testing.assert_array_equal(live.dataset.spectrum, reference_histogram(events[:n_complete]))
+    assert live.n_events == len(events)
+
+
+@pytest.mark.parametrize('max_workers, chunk_size', [(1, None), (2, 3000)])
+@pytest.mark.parametrize('energy_cut, time_cut', [(None, None), ((20, 150), None), (None, (10**7, 6 * 10**7))])
+def test_histogram_file(events_file, max_workers, chunk_size, energy_cut, time_cut):
+    file, events = events_file
+    spectrum = histogram_file(
+        file, n_bins=N_BINS, energy_cut=energy_cut, time_cut=time_cut,
+        max_workers=max_workers, chunk_size=chunk_size
+    ).spectrum
+    np.testing.assert_array_equal(spectrum, reference_histogram(events, energy_cut, time_cut))
+
+
+@pytest.mark.parametrize('max_workers, chunk_size', [(1, None), (2, 3000)])
+def test_histogram_matrix(events_file, monkeypatch, max_workers, chunk_size):
+    # a wider window than the default, so the pairs span the chunk borders
+    monkeypatch.setattr(settings, 'COINCIDENCE_WINDOW', 20000)
+    file, events = events_file
+    matrix = histogram_matrix(file, n_bins=N_BINS, max_workers=max_workers, chunk_size=chunk_size)
+    expected = reference_matrix(events)
+    assert expected.sum()
+    np.testing.assert_array_equal(matrix, expected)
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from spectview.datatypes import DataSet
+from spectview.hdf5_matrix import HDF5Matrix
+from spectview.projection import Projector
+
+
+def gated(size, window):
+    # bins which centres lie inside the window
+    if window is None:
+        return np.ones(size, dtype=bool)
+    low, high = sorted(window)
+    bins = np.arange(size)
+    return (bins >= low) & (bins <= high)
+
+
+def brute_force(matrix, gates, backgrounds=()):
+    def project(window):
+        if matrix.ndim == 2:
+            gate_z, gate_y = None, window[1]
+            planes = matrix[None]
+        else:
+            gate_z, gate_y = window
+            planes = matrix
+        z_mask = gated(planes.shape[0], gate_z)
+        y_mask = gated(planes.shape[1], gate_y)
+        return planes[z_mask][:, y_mask].sum(axis=(0, 1)), z_mask.sum() * y_mask.sum()
+
+    gate_spectra, gate_areas = zip(*[project(window) for window in gates])
+    spectrum = np.sum(gate_spectra, axis=0).astype(float)
+    if backgrounds:
+        bg_spectra, bg_areas = zip(*[project(window) for window in backgrounds])
+        if sum(bg_areas):
+            spectrum -= sum(gate_areas) / sum(bg_areas) * np.sum(bg_spectra, axis=0)
+    return spectrum
+
+
+def random_window(random_state, size):
+    # fractional, reversed and partly outside of the matrix windows too
+    return tuple(random_state.uniform(-3, size + 3, 2))
+
+
+def test_matrix_gates():
+    random_state = np.random.RandomState(0)
+    matrix = random_state.poisson(3, (60, 80))
+    projector = Projector(matrix)
+    for _ in range(50):
+        gates = [(None, random_window(random_state, 60)) for _ in range(random_state.randint(1, 3))]
+        backgrounds = [(None, random_window(random_state, 60)) for _ in range(random_state.randint(0, 3))]
+        np.testing.assert_allclose(
+            projector.project(gates, backgrounds), brute_force(matrix, gates, backgrounds), atol=1e-9
+        )
+
+
+def test_cube_gates():
+    # the next z gates reuse the prefix sums of the cached ones
+    random_state = np.random.RandomState(1)
+    cube = random_state.poisson(1, (30, 25, 40))
+    projector = Projector(cube)
+    for _ in range(50):
+        gates = [(random_window(random_state, 30), random_window(random_state, 25))]
+        backgrounds = [(random_window(random_state, 30), random_window(random_state, 25))]
+        np.testing.assert_allclose(
+            projector.project(gates, backgrounds), brute_force(cube, gates, backgrounds), atol=1e-9
+        )
+        np.testing.assert_array_equal(projector.project(gates), brute_force(cube, gates))
+
+
+def test_hdf5_gates(tmp_path):
+    h5py = pytest.importorskip('h5py')
+    random_state = np.random.RandomState(2)
+    cube = random_state.poisson(1, (20, 30, 50))
+    file = str(tmp_path / 'cube.h5')
+    with h5py.File(file, 'w') as f:
+        f['cube'] = cube
+
+    with HDF5Matrix(file) as matrix:
+        projector = Projector(matrix)
+        for _ in range(20):
+            window = (random_window(random_state, 20), random_window(random_state, 30))
+            expected = brute_force(cube, [window])
+            np.testing.assert_array_equal(matrix.project(gate_z=window[0], gate_y=window[1]), expected)
+            np.testing.assert_array_equal(projector.project([window]), expected)
+            np.testing.assert_array_equal(
+                DataSet.from_hdf5(file, gate_z=window[0], gate_y=window[1]).spectrum, expected
+            )
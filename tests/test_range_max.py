@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from spectview.range_max import RangeMaxIndex
+
+
+@pytest.mark.parametrize('n_bins', [1, 63, 64, 65, 200, 4097])
+def test_max_of_slice(n_bins):
+    random_state = np.random.RandomState(n_bins)
+    data_y = random_state.poisson(100, n_bins)
+    index = RangeMaxIndex(np.arange(n_bins), data_y)
+    for _ in range(500):
+        start, stop = sorted(random_state.randint(0, n_bins + 1, 2))
+        if start == stop:
+            continue
+        assert index.max_of_slice(start, stop) == data_y[start:stop].max()
+
+
+def test_max_in_range():
+    random_state = np.random.RandomState(0)
+    data_x = np.cumsum(random_state.uniform(0.1, 1.0, 3000))
+    data_y = random_state.normal(size=3000)
+    index = RangeMaxIndex(data_x, data_y)
+    for _ in range(500):
+        x1, x2 = sorted(random_state.uniform(data_x[0] - 5, data_x[-1] + 5, 2))
+        inside = (data_x >= x1) & (data_x <= x2)
+        if inside.any():
+            assert index.max_in_range(x1, x2) == data_y[inside].max()
+
+
+def test_empty_range():
+    index = RangeMaxIndex(np.arange(10), np.arange(10))
+    with pytest.raises(ValueError):
+        index.max_of_slice(5, 5)
+    with pytest.raises(ValueError):
+        index.max_in_range(20, 30)
@@ -0,0 +1,37 @@
+import matplotlib.pyplot as plt
+import pytest
+from matplotlib.backend_bases import KeyEvent
+
+from spectview.window import Window
+
+
+@pytest.fixture
+def window():
+    window = Window()
+    window.dispatched = []
+    window._dispatch = lambda function_name, *args: window.dispatched.append(function_name)
+    yield window
+    plt.close(window.fig)
+
+
+def type_keys(window, keys):
+    for key in keys:
+        window.fig.canvas.callbacks.process('key_press_event', KeyEvent('key_press_event', window.fig.canvas, key))
+
+
+def test_keys_run_the_actions(window):
+    type_keys(window, 'rc')
+    assert window.dispatched == [Window.KEYMAP['r'], Window.KEYMAP['c']]
+
+
+@pytest.mark.parametrize('box, text', [
+    ('calibrate', 'run.cl'),
+    ('find', 'bg 539'),
+    ('expression', 'gate_g1436g444 - 0.3*bg_g1436g444'),
+])
+def test_keys_typed_into_text_boxes_run_no_actions(window, box, text):
+    text_box = getattr(window, f'tbox_{box}')
+    text_box.begin_typing()
+    type_keys(window, text)
+    assert window.dispatched == []
+    assert text_box.text == text